@@ -0,0 +1,328 @@
+"""Benchmark lapisan database backend.
+
+Contoh:
+    python benchmark.py pool --threads 16 --scans 2000
+    python benchmark.py index --drivers 10000 100000
+    python benchmark.py toggle --threads 16 --drivers 20
+    python benchmark.py publish --admins 10 --late-drivers 5
+    python benchmark.py ingest --scans 5000 --threads 32
+    python benchmark.py state --drivers 200 2000 --reads 2000
+"""
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from db import ConnectionPool, migrate, DRIVER_FIELDS, SCAN_TOGGLE_SQL
+from driver_state import DriverStateCache
+from fake_broker import FakeBroker
+from publisher import AlertPublisher
+from scan_ingest import ScanBatcher
+
+
+def seed(path: str, n_drivers: int, indexed: bool = True):
+    conn = sqlite3.connect(path)
+    migrate(conn)
+    if not indexed:
+        # Skema lama: tanpa index pada fingerprint_id / status
+        conn.execute("DROP INDEX idx_drivers_fingerprint_id")
+        conn.execute("DROP INDEX idx_drivers_status")
+    conn.executemany(
+        "INSERT INTO drivers (name, fingerprint_id, status, phone_number) VALUES (?, ?, 'STAY', ?)",
+        ((f"Driver {i}", i, f"62800000{i:05d}") for i in range(1, n_drivers + 1)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def scan(conn: sqlite3.Connection, fingerprint_id: int):
+    # Sama dengan jalur toggle_driver_status_by_fingerprint
+    driver = conn.execute("SELECT * FROM drivers WHERE fingerprint_id=?", (fingerprint_id,)).fetchone()
+    new_status = "JALAN" if driver[3] == "STAY" else "STAY"
+    delivery_start = datetime.now().isoformat() if new_status == "JALAN" else None
+    conn.execute(
+        "UPDATE drivers SET status=?, delivery_start=? WHERE id=?",
+        (new_status, delivery_start, driver[0]),
+    )
+    conn.commit()
+
+
+def scan_atomic(conn: sqlite3.Connection, fingerprint_id: int):
+    now = datetime.now()
+    conn.execute(SCAN_TOGGLE_SQL, (now.isoformat(), int(now.timestamp()), fingerprint_id)).fetchone()
+    conn.commit()
+
+
+def scan_connect_per_request(path: str, fingerprint_id: int):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    try:
+        scan(conn, fingerprint_id)
+    finally:
+        conn.close()
+
+
+def run(label: str, fn, n_scans: int, n_drivers: int, threads: int):
+    latencies = []
+    lock = threading.Lock()
+
+    def one(i: int):
+        start = time.perf_counter()
+        fn(i % n_drivers + 1)
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(one, range(n_scans)))
+    total = time.perf_counter() - started
+    report(label, latencies, total)
+
+
+def report(label: str, latencies: list, total: float):
+    latencies = sorted(latencies)
+    q = statistics.quantiles(latencies, n=100)
+    print(
+        f"{label:<28} n={len(latencies):<6} "
+        f"throughput={len(latencies) / total:8.0f}/s  "
+        f"p50={q[49] * 1000:7.3f}ms  p95={q[94] * 1000:7.3f}ms  p99={q[98] * 1000:7.3f}ms"
+    )
+
+
+def bench_pool(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        seed(path, args.drivers)
+        run("connect-per-request", lambda fp: scan_connect_per_request(path, fp),
+            args.scans, args.drivers, args.threads)
+
+        pool = ConnectionPool(path, size=args.pool_size)
+
+        def pooled(fp: int):
+            with pool.connection() as conn:
+                scan(conn, fp)
+
+        run(f"pool (size={args.pool_size}, WAL)", pooled, args.scans, args.drivers, args.threads)
+        pool.close()
+
+
+def bench_index(args):
+    for n_drivers in args.drivers:
+        for indexed in (False, True):
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "bench.db")
+                seed(path, n_drivers, indexed=indexed)
+                pool = ConnectionPool(path, size=1)
+                latencies = []
+                started = time.perf_counter()
+                with pool.connection() as conn:
+                    for i in range(args.scans):
+                        fp = (i * 7919) % n_drivers + 1
+                        start = time.perf_counter()
+                        scan(conn, fp)
+                        latencies.append(time.perf_counter() - start)
+                total = time.perf_counter() - started
+                pool.close()
+                label = f"{n_drivers} drivers {'indexed' if indexed else 'full scan'}"
+                report(label, latencies, total)
+
+
+def bench_toggle(args):
+    # Setiap driver di-scan sejumlah genap kali, jadi status akhir harus
+    # kembali STAY. Driver yang tidak STAY menandakan lost update.
+    n_scans = args.drivers * args.scans_per_driver
+    for label, fn in (("select + update", scan), ("atomic RETURNING", scan_atomic)):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bench.db")
+            seed(path, args.drivers)
+            pool = ConnectionPool(path, size=args.threads)
+
+            def one(fp: int):
+                with pool.connection() as conn:
+                    fn(conn, fp)
+
+            run(label, one, n_scans, args.drivers, args.threads)
+            with pool.connection() as conn:
+                lost = conn.execute("SELECT COUNT(*) FROM drivers WHERE status != 'STAY'").fetchone()[0]
+            pool.close()
+            print(f"{'':<28} drivers with lost updates: {lost}/{args.drivers}")
+
+
+def bench_publish(args):
+    # Satu sync run: pesan untuk setiap driver terlambat + setiap admin
+    payloads = [
+        {"command": "send_message", "number_recipient": f"62{i}", "message": "x" * 200}
+        for i in range(args.late_drivers * (args.admins + 1))
+    ]
+    broker = FakeBroker(connect_latency=args.connect_ms / 1000, rtt=args.rtt_ms / 1000)
+
+    def connect_per_message():
+        # Jalur lama publish_late_driver: koneksi baru untuk setiap pesan
+        for payload in payloads:
+            connection = broker()
+            channel = connection.channel()
+            channel.queue_declare(queue="bench", durable=True)
+            channel.basic_publish(exchange='', routing_key="bench", body=json.dumps(payload))
+            connection.close()
+
+    publisher = AlertPublisher(broker, "bench")
+
+    for label, fn in (("connect per message", connect_per_message),
+                      ("pooled batch", lambda: publisher.publish_batch(payloads))):
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            fn()
+            latencies.append(time.perf_counter() - start)
+        report(f"{label} ({len(payloads)} msg)", latencies, time.perf_counter() - started)
+    publisher.close()
+
+
+def bench_ingest(args):
+    # Commit per scan (jalur HTTP) vs ScanBatcher (jalur MQTT). Latensi
+    # batcher dihitung dari submit sampai hasil scan tersedia.
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        seed(path, args.drivers)
+        pool = ConnectionPool(path, size=args.threads)
+
+        def per_scan(fp: int):
+            with pool.connection() as conn:
+                scan_atomic(conn, fp)
+
+        run("commit per scan", per_scan, args.scans, args.drivers, args.threads)
+
+        latencies = []
+
+        def on_result(event, driver):
+            latencies.append(time.perf_counter() - event["submitted"])
+            event["done"].set()
+
+        batcher = ScanBatcher(pool, on_result, window=args.window_ms / 1000)
+        batcher.start()
+
+        def submit(fp: int):
+            done = threading.Event()
+            batcher.submit({"fingerprint_id": fp, "submitted": time.perf_counter(), "done": done})
+            # Device menunggu hasil scan sebelum scan berikutnya
+            done.wait()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            list(executor.map(lambda i: submit(i % args.drivers + 1), range(args.scans)))
+        total = time.perf_counter() - started
+        batcher.stop()
+        pool.close()
+        report(f"batched (window={args.window_ms:g}ms)", latencies, total)
+
+
+def bench_state(args):
+    # Bacaan per polling dashboard + cek keterlambatan: daftar driver,
+    # jumlah per status, dan kandidat terlambat. Query SQLite vs
+    # DriverStateCache; statement yang dieksekusi dihitung lewat trace
+    # callback untuk menunjukkan jalur cache tidak menyentuh database.
+    for n_drivers in args.drivers:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bench.db")
+            seed(path, n_drivers)
+            pool = ConnectionPool(path, size=1)
+            cutoff = int(time.time()) - 2700
+            with pool.connection() as conn:
+                # Separuh driver JALAN, sebagian sudah lewat threshold
+                conn.execute("""
+                    UPDATE drivers SET status = 'JALAN',
+                        delivery_start_epoch = CAST(strftime('%s', 'now') AS INTEGER) - (id % 90) * 60
+                    WHERE id % 2 = 0
+                """)
+                conn.commit()
+                state = DriverStateCache()
+                state.load(conn)
+
+                statements = []
+                conn.set_trace_callback(statements.append)
+
+                def from_db():
+                    conn.execute(f"SELECT {', '.join(DRIVER_FIELDS)} FROM drivers ORDER BY id").fetchall()
+                    conn.execute("SELECT status, COUNT(*) FROM drivers GROUP BY status").fetchall()
+                    conn.execute("""
+                        SELECT id, delivery_start_epoch FROM drivers INDEXED BY idx_drivers_late
+                        WHERE status = 'JALAN' AND late_notified = 0 AND delivery_start_epoch <= ?
+                    """, (cutoff,)).fetchall()
+
+                def from_cache():
+                    [{field: row[field] for field in DRIVER_FIELDS} for row in state.select()]
+                    counts = {}
+                    for row in state.select():
+                        counts[row["status"]] = counts.get(row["status"], 0) + 1
+                    state.late_candidates(cutoff)
+
+                for label, fn in (("sqlite", from_db), ("memory", from_cache)):
+                    del statements[:]
+                    latencies = []
+                    started = time.perf_counter()
+                    for _ in range(args.reads):
+                        start = time.perf_counter()
+                        fn()
+                        latencies.append(time.perf_counter() - start)
+                    report(f"{n_drivers} drivers {label}", latencies, time.perf_counter() - started)
+                    print(f"{'':<28} statements executed: {len(statements)}")
+                conn.set_trace_callback(None)
+            pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("pool", help="connect-per-request vs connection pool")
+    p.add_argument("--drivers", type=int, default=200)
+    p.add_argument("--scans", type=int, default=2000)
+    p.add_argument("--threads", type=int, default=16)
+    p.add_argument("--pool-size", type=int, default=8)
+    p.set_defaults(func=bench_pool)
+
+    p = sub.add_parser("index", help="scan lookup with and without fingerprint_id index")
+    p.add_argument("--drivers", type=int, nargs="+", default=[10_000, 100_000])
+    p.add_argument("--scans", type=int, default=500)
+    p.set_defaults(func=bench_index)
+
+    p = sub.add_parser("toggle", help="select+update vs atomic toggle under concurrent scans")
+    p.add_argument("--drivers", type=int, default=20)
+    p.add_argument("--scans-per-driver", type=int, default=100)
+    p.add_argument("--threads", type=int, default=16)
+    p.set_defaults(func=bench_toggle)
+
+    p = sub.add_parser("publish", help="per-message connections vs pooled batched publisher")
+    p.add_argument("--admins", type=int, default=10)
+    p.add_argument("--late-drivers", type=int, default=5)
+    p.add_argument("--runs", type=int, default=20)
+    p.add_argument("--connect-ms", type=float, default=5.0, help="simulated TCP/AMQP handshake")
+    p.add_argument("--rtt-ms", type=float, default=0.5, help="simulated broker round-trip")
+    p.set_defaults(func=bench_publish)
+
+    p = sub.add_parser("ingest", help="commit per scan vs batched MQTT scan ingestion")
+    p.add_argument("--drivers", type=int, default=200)
+    p.add_argument("--scans", type=int, default=5000)
+    p.add_argument("--threads", type=int, default=32, help="device yang scan bersamaan")
+    p.add_argument("--window-ms", type=float, default=5.0)
+    p.set_defaults(func=bench_ingest)
+
+    p = sub.add_parser("state", help="driver reads from SQLite vs in-memory driver state")
+    p.add_argument("--drivers", type=int, nargs="+", default=[200, 2000])
+    p.add_argument("--reads", type=int, default=2000)
+    p.set_defaults(func=bench_state)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
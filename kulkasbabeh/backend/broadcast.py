@@ -0,0 +1,51 @@
+import asyncio
+import threading
+
+
+class StatusBroadcaster:
+    """Fan-out event perubahan status ke banyak subscriber WebSocket.
+
+    Setiap subscriber punya antrean berbatas sendiri. Jika client terlalu
+    lambat dan antreannya penuh, isinya dibuang dan diganti satu event
+    `resync` sehingga client mengambil ulang data lewat /drivers/changes;
+    satu client lambat tidak menahan client lain maupun endpoint scan.
+    """
+
+    def __init__(self, buffer_size: int = 100):
+        self.buffer_size = buffer_size
+        self._subscribers = set()
+        self._loop = None
+        self._lock = threading.Lock()
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.buffer_size)
+        with self._lock:
+            self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        with self._lock:
+            self._subscribers.discard(queue)
+
+    def publish(self, event: dict):
+        """Kirim event ke semua subscriber. Aman dipanggil dari thread mana pun."""
+        if self._loop is None or not self._subscribers:
+            return
+        self._loop.call_soon_threadsafe(self._fanout, event)
+
+    def _fanout(self, event: dict):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for queue in subscribers:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"type": "resync"})
+
+    def __len__(self):
+        return len(self._subscribers)
@@ -0,0 +1,78 @@
+import json
+import threading
+import uuid
+
+from fastapi import Request, Response
+
+
+class VersionedResponseCache:
+    """Cache respons JSON yang berlaku selama versi data belum berubah.
+
+    Setiap endpoint yang menulis data memanggil `bump()`. Endpoint baca
+    memakai `respond()`: jika ETag client sama dengan versi sekarang,
+    dikembalikan 304 tanpa query maupun encoding JSON; jika tidak, bytes
+    hasil serialisasi terakhir dipakai ulang selama versinya sama.
+    """
+
+    def __init__(self):
+        # Token unik per proses agar ETag lama tidak cocok setelah restart
+        self._boot = uuid.uuid4().hex[:8]
+        self.version = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def bump(self):
+        with self._lock:
+            self.version += 1
+
+    def etag(self, version: int) -> str:
+        return f'"{self._boot}-{version}"'
+
+    def _matches(self, request: Request, etag: str) -> bool:
+        header = request.headers.get("if-none-match")
+        if not header:
+            return False
+        tags = [tag.strip() for tag in header.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+    def respond(self, request: Request, key: str, build) -> Response:
+        """`build()` dipanggil hanya jika cache untuk versi ini belum ada."""
+        # Versi dibaca sebelum query: jika ada tulis di tengah jalan, versi
+        # berikutnya akan membangun ulang cache
+        version = self.version
+        etag = self.etag(version)
+        if self._matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        body = self._cached(key, version)
+        if body is None:
+            body = self._store(key, version, build())
+        return self._response(body, etag)
+
+    async def respond_async(self, request: Request, key: str, build) -> Response:
+        """Sama dengan `respond()`, untuk `build` berupa coroutine function."""
+        version = self.version
+        etag = self.etag(version)
+        if self._matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        body = self._cached(key, version)
+        if body is None:
+            body = self._store(key, version, await build())
+        return self._response(body, etag)
+
+    def _cached(self, key, version: int):
+        # key None: respons tidak disimpan (mis. hasil filter/pagination)
+        if key is None:
+            return None
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        return None
+
+    def _store(self, key, version: int, data) -> bytes:
+        body = json.dumps(data, separators=(",", ":")).encode()
+        if key is not None:
+            self._entries[key] = (version, body)
+        return body
+
+    def _response(self, body: bytes, etag: str) -> Response:
+        return Response(content=body, media_type="application/json", headers={"ETag": etag})
@@ -0,0 +1,430 @@
+import sqlite3
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+from queue import Queue, Empty, Full
+
+# Pragma untuk setiap koneksi di pool. WAL membuat pembaca tidak memblokir
+# penulis, sehingga scan dari banyak ESP32 tidak saling menunggu.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+)
+
+# Jumlah prepared statement yang disimpan per koneksi oleh modul sqlite3
+STATEMENT_CACHE_SIZE = 256
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """Buka koneksi SQLite yang sudah di-tuning untuk dipakai di pool."""
+    conn = sqlite3.connect(
+        path,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    """Pool koneksi SQLite berbatas (queue-backed).
+
+    Koneksi dibuat secara lazy sampai `size`, lalu dipakai ulang. Karena
+    koneksi tidak pernah ditutup, cache prepared statement milik sqlite3
+    ikut dipakai ulang antar request.
+    """
+
+    def __init__(self, path: str, size: int = 8, timeout: float = 10.0):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = Queue(maxsize=size)
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return connect(self.path)
+                except Exception:
+                    self._created -= 1
+                    raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except Empty:
+            raise RuntimeError("Database connection pool exhausted") from None
+
+    def release(self, conn: sqlite3.Connection):
+        # Jangan kembalikan koneksi dengan transaksi yang masih terbuka
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except Full:
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+def to_epoch(delivery_start):
+    """Konversi delivery_start (ISO, waktu lokal) ke detik unix."""
+    if not delivery_start:
+        return None
+    return int(datetime.fromisoformat(delivery_start).timestamp())
+
+
+# Kolom driver yang terlihat oleh client; perubahan pada kolom ini dicatat
+# di driver_changes
+DRIVER_FIELDS = ("id", "name", "fingerprint_id", "phone_number", "status", "delivery_start")
+
+# Kolom yang disalin di DriverStateCache (lihat driver_state.py). Setiap
+# UPDATE pada drivers menaikkan row_version.
+STATE_FIELDS = DRIVER_FIELDS + ("delivery_start_epoch", "late_notified", "row_version")
+STATE_COLUMNS = ", ".join(STATE_FIELDS)
+
+
+# --- Query scan fingerprint -------------------------------------------------
+# Toggle dalam satu statement: status lama disimpan di previous_status lalu
+# dikembalikan bersama status baru lewat RETURNING (SQLite >= 3.35).
+# Parameter: (delivery_start, delivery_start_epoch, fingerprint_id)
+SCAN_TOGGLE_SQL = f"""
+    UPDATE drivers
+    SET previous_status = status,
+        status = CASE status WHEN 'STAY' THEN 'JALAN' ELSE 'STAY' END,
+        delivery_start = CASE status WHEN 'STAY' THEN ? ELSE NULL END,
+        delivery_start_epoch = CASE status WHEN 'STAY' THEN ? ELSE NULL END,
+        late_notified = 0, row_version = row_version + 1
+    WHERE fingerprint_id = ?
+    RETURNING {STATE_COLUMNS}, previous_status
+"""
+
+# Parameter: (fingerprint_id,)
+SCAN_OFF_SQL = f"""
+    UPDATE drivers
+    SET previous_status = status, status = 'OFF',
+        delivery_start = NULL, delivery_start_epoch = NULL, late_notified = 0,
+        row_version = row_version + 1
+    WHERE fingerprint_id = ?
+    RETURNING {STATE_COLUMNS}, previous_status
+"""
+
+
+# --- Migrasi skema --------------------------------------------------------
+# Setiap migrasi dijalankan sekali, urut, dan versinya dicatat di
+# PRAGMA user_version. Tambahkan migrasi baru di akhir daftar MIGRATIONS.
+
+def _columns(conn: sqlite3.Connection, table: str) -> set:
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _create_base_tables(conn: sqlite3.Connection):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS drivers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        fingerprint_id INTEGER,
+        status TEXT CHECK(status IN ('STAY', 'JALAN', 'OFF')) NOT NULL DEFAULT 'OFF',
+        delivery_start TEXT,
+        phone_number TEXT
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS admins (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        phone_number TEXT NOT NULL
+    )
+    ''')
+
+
+def _add_driver_phone_number(conn: sqlite3.Connection):
+    # Database lama dibuat sebelum kolom phone_number ada
+    if "phone_number" not in _columns(conn, "drivers"):
+        conn.execute("ALTER TABLE drivers ADD COLUMN phone_number TEXT")
+
+
+def _index_drivers(conn: sqlite3.Connection):
+    duplicates = conn.execute("""
+        SELECT fingerprint_id FROM drivers
+        WHERE fingerprint_id IS NOT NULL
+        GROUP BY fingerprint_id HAVING COUNT(*) > 1
+    """).fetchall()
+    if duplicates:
+        ids = ", ".join(str(row[0]) for row in duplicates)
+        raise RuntimeError(f"Duplicate fingerprint_id in drivers table: {ids}")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_drivers_fingerprint_id ON drivers(fingerprint_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_drivers_status ON drivers(status)")
+
+
+def _add_driver_previous_status(conn: sqlite3.Connection):
+    # Diisi oleh UPDATE toggle agar status lama bisa dikembalikan lewat RETURNING
+    conn.execute("ALTER TABLE drivers ADD COLUMN previous_status TEXT")
+
+
+def _add_driver_lateness_columns(conn: sqlite3.Connection):
+    # delivery_start_epoch: detik unix (waktu lokal) dari delivery_start, agar
+    # keterlambatan bisa dihitung di SQL lewat index.
+    # late_notified: 1 jika notifikasi terlambat untuk trip ini sudah dikirim.
+    conn.execute("ALTER TABLE drivers ADD COLUMN delivery_start_epoch INTEGER")
+    conn.execute("ALTER TABLE drivers ADD COLUMN late_notified INTEGER NOT NULL DEFAULT 0")
+    rows = conn.execute("SELECT id, delivery_start FROM drivers WHERE delivery_start IS NOT NULL").fetchall()
+    conn.executemany(
+        "UPDATE drivers SET delivery_start_epoch = ? WHERE id = ?",
+        [(to_epoch(row[1]), row[0]) for row in rows],
+    )
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_drivers_late ON drivers(delivery_start_epoch)
+        WHERE status = 'JALAN' AND late_notified = 0
+    """)
+
+
+def _create_alert_outbox(conn: sqlite3.Connection):
+    # Outbox pesan WhatsApp, dikirim ke RabbitMQ oleh AlertOutbox.dispatch()
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS alert_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        payload TEXT NOT NULL,
+        status TEXT CHECK(status IN ('PENDING', 'DEAD')) NOT NULL DEFAULT 'PENDING',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_epoch REAL NOT NULL,
+        last_error TEXT,
+        created_epoch REAL NOT NULL
+    )
+    ''')
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_alert_outbox_due ON alert_outbox(next_attempt_epoch)
+        WHERE status = 'PENDING'
+    """)
+
+
+def _create_driver_changes(conn: sqlite3.Connection):
+    # Change-log untuk GET /drivers/changes. Ditulis oleh trigger sehingga
+    # selalu satu transaksi dengan perubahan di tabel drivers. Hanya entri
+    # terakhir per driver yang disimpan, jadi ukurannya sebanding jumlah
+    # driver (+ tombstone untuk driver yang dihapus).
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS driver_changes (
+        version INTEGER PRIMARY KEY AUTOINCREMENT,
+        driver_id INTEGER NOT NULL,
+        deleted INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_driver_changes_driver_id ON driver_changes(driver_id)")
+
+    changed = " OR ".join(f"OLD.{field} IS NOT NEW.{field}" for field in DRIVER_FIELDS)
+    for event, row, deleted, when in (
+        ("INSERT", "NEW", 0, ""),
+        ("UPDATE", "NEW", 0, f"WHEN {changed}"),
+        ("DELETE", "OLD", 1, ""),
+    ):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_driver_changes_{event.lower()}
+            AFTER {event} ON drivers {when}
+            BEGIN
+                DELETE FROM driver_changes WHERE driver_id = {row}.id;
+                INSERT INTO driver_changes (driver_id, deleted) VALUES ({row}.id, {deleted});
+            END
+        """)
+
+    # Driver yang sudah ada masuk change-log agar since=0 = seluruh tabel
+    conn.execute("INSERT INTO driver_changes (driver_id) SELECT id FROM drivers ORDER BY id")
+
+
+def _create_trips(conn: sqlite3.Connection):
+    # Riwayat trip (append-only): satu baris setiap transisi JALAN -> STAY/OFF,
+    # ditulis oleh trigger sehingga semua jalur update (scan, PUT, bulk)
+    # tercatat. late = notifikasi terlambat sudah dikirim untuk trip itu.
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS trips (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        driver_id INTEGER NOT NULL,
+        start_epoch INTEGER NOT NULL,
+        end_epoch INTEGER NOT NULL,
+        duration_seconds INTEGER NOT NULL,
+        late INTEGER NOT NULL,
+        end_status TEXT NOT NULL
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_trips_end_epoch ON trips(end_epoch)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_trips_driver_end_epoch ON trips(driver_id, end_epoch)")
+
+    # Rekap harian per driver (tanggal lokal dari end_epoch), diperbarui
+    # trigger setiap ada trip baru; query analitik membaca tabel ini,
+    # bukan memindai riwayat trip
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS trip_daily (
+        day TEXT NOT NULL,
+        driver_id INTEGER NOT NULL,
+        trips INTEGER NOT NULL,
+        late_trips INTEGER NOT NULL,
+        total_seconds INTEGER NOT NULL,
+        max_seconds INTEGER NOT NULL,
+        PRIMARY KEY (day, driver_id)
+    ) WITHOUT ROWID
+    ''')
+
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_trips_record
+        AFTER UPDATE OF status ON drivers
+        WHEN OLD.status = 'JALAN' AND NEW.status <> 'JALAN' AND OLD.delivery_start_epoch IS NOT NULL
+        BEGIN
+            INSERT INTO trips (driver_id, start_epoch, end_epoch, duration_seconds, late, end_status)
+            VALUES (
+                OLD.id, OLD.delivery_start_epoch, CAST(strftime('%s', 'now') AS INTEGER),
+                MAX(CAST(strftime('%s', 'now') AS INTEGER) - OLD.delivery_start_epoch, 0),
+                OLD.late_notified, NEW.status
+            );
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_trip_daily_rollup
+        AFTER INSERT ON trips
+        BEGIN
+            INSERT INTO trip_daily (day, driver_id, trips, late_trips, total_seconds, max_seconds)
+            VALUES (
+                date(NEW.end_epoch, 'unixepoch', 'localtime'), NEW.driver_id,
+                1, NEW.late, NEW.duration_seconds, NEW.duration_seconds
+            )
+            ON CONFLICT (day, driver_id) DO UPDATE SET
+                trips = trips + 1,
+                late_trips = late_trips + excluded.late_trips,
+                total_seconds = total_seconds + excluded.total_seconds,
+                max_seconds = MAX(max_seconds, excluded.max_seconds);
+        END
+    """)
+
+
+def _create_lateness_rules(conn: sqlite3.Connection):
+    # Threshold keterlambatan disimpan di server (lihat thresholds.py):
+    # default di settings, per zona di zones, dan override per driver
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS zones (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        threshold_minutes INTEGER
+    )
+    ''')
+    conn.execute("ALTER TABLE drivers ADD COLUMN zone_id INTEGER REFERENCES zones(id)")
+    conn.execute("ALTER TABLE drivers ADD COLUMN late_threshold_minutes INTEGER")
+
+
+def _add_driver_row_version(conn: sqlite3.Connection):
+    # Versi baris untuk DriverStateCache: baris lama dari RETURNING tidak
+    # boleh menimpa baris yang lebih baru di memori
+    conn.execute("ALTER TABLE drivers ADD COLUMN row_version INTEGER NOT NULL DEFAULT 0")
+
+
+def _threshold_minutes_sql(row: str) -> str:
+    # Threshold yang berlaku untuk driver `row` (urutan sama dengan
+    # LatenessRules): override driver, lalu zona, lalu default di settings
+    return f"""COALESCE(
+        {row}.late_threshold_minutes,
+        (SELECT threshold_minutes FROM zones WHERE id = {row}.zone_id),
+        (SELECT CAST(value AS INTEGER) FROM settings WHERE key = 'late_threshold_minutes')
+    )"""
+
+
+def _trip_late_from_threshold(conn: sqlite3.Connection):
+    # late dihitung dari durasi trip terhadap threshold yang berlaku, bukan
+    # hanya dari late_notified: trip yang lewat threshold tapi selesai
+    # sebelum cek keterlambatan berikutnya tetap tercatat terlambat
+    conn.execute("DROP TRIGGER IF EXISTS trg_trips_record")
+    conn.execute(f"""
+        CREATE TRIGGER trg_trips_record
+        AFTER UPDATE OF status ON drivers
+        WHEN OLD.status = 'JALAN' AND NEW.status <> 'JALAN' AND OLD.delivery_start_epoch IS NOT NULL
+        BEGIN
+            INSERT INTO trips (driver_id, start_epoch, end_epoch, duration_seconds, late, end_status)
+            SELECT OLD.id, OLD.delivery_start_epoch, end_epoch, duration,
+                   MAX(OLD.late_notified, COALESCE(duration >= {_threshold_minutes_sql("OLD")} * 60, 0)),
+                   NEW.status
+            FROM (
+                SELECT CAST(strftime('%s', 'now') AS INTEGER) AS end_epoch,
+                       MAX(CAST(strftime('%s', 'now') AS INTEGER) - OLD.delivery_start_epoch, 0) AS duration
+            );
+        END
+    """)
+
+    # Trip lama dihitung ulang dengan aturan saat ini, lalu rekap harian
+    # dibangun ulang dari riwayat trip
+    conn.execute(f"""
+        UPDATE trips SET late = 1
+        WHERE late = 0 AND duration_seconds >= (
+            SELECT {_threshold_minutes_sql("d")} * 60 FROM drivers d WHERE d.id = trips.driver_id
+        )
+    """)
+    conn.execute("DELETE FROM trip_daily")
+    conn.execute("""
+        INSERT INTO trip_daily (day, driver_id, trips, late_trips, total_seconds, max_seconds)
+        SELECT date(end_epoch, 'unixepoch', 'localtime'), driver_id,
+               COUNT(*), SUM(late), SUM(duration_seconds), MAX(duration_seconds)
+        FROM trips GROUP BY 1, 2
+    """)
+
+
+MIGRATIONS = [
+    _create_base_tables,
+    _add_driver_phone_number,
+    _index_drivers,
+    _add_driver_previous_status,
+    _add_driver_lateness_columns,
+    _create_alert_outbox,
+    _create_driver_changes,
+    _create_trips,
+    _create_lateness_rules,
+    _add_driver_row_version,
+    _trip_late_from_threshold,
+]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Jalankan migrasi yang belum diterapkan, kembalikan versi skema."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        # BEGIN eksplisit agar DDL ikut dalam transaksi dan migrasi atomik
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version={number}")
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+    return len(MIGRATIONS)
@@ -0,0 +1,73 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import aiosqlite
+
+from db import PRAGMAS, STATEMENT_CACHE_SIZE
+
+
+async def connect(path: str) -> aiosqlite.Connection:
+    """Buka koneksi aiosqlite dengan pragma yang sama seperti db.connect()."""
+    conn = await aiosqlite.connect(path, cached_statements=STATEMENT_CACHE_SIZE)
+    conn.row_factory = aiosqlite.Row
+    for pragma in PRAGMAS:
+        await conn.execute(pragma)
+    return conn
+
+
+class AsyncConnectionPool:
+    """Pool koneksi aiosqlite berbatas untuk handler `async def`.
+
+    Query dijalankan di thread milik masing-masing koneksi aiosqlite, jadi
+    handler async tidak memakai threadpool Starlette (default ~40 thread)
+    yang juga dipakai handler sinkron.
+    """
+
+    def __init__(self, path: str, size: int = 8, timeout: float = 10.0):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = asyncio.Queue(maxsize=size)
+        self._created = 0
+        self._all = []
+
+    async def acquire(self) -> aiosqlite.Connection:
+        try:
+            return self._idle.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+
+        if self._created < self.size:
+            self._created += 1
+            try:
+                conn = await connect(self.path)
+            except Exception:
+                self._created -= 1
+                raise
+            self._all.append(conn)
+            return conn
+
+        try:
+            return await asyncio.wait_for(self._idle.get(), self.timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError("Database connection pool exhausted") from None
+
+    async def release(self, conn: aiosqlite.Connection):
+        if conn.in_transaction:
+            await conn.rollback()
+        self._idle.put_nowait(conn)
+
+    @asynccontextmanager
+    async def connection(self):
+        conn = await self.acquire()
+        try:
+            yield conn
+        finally:
+            await self.release(conn)
+
+    async def close(self):
+        for conn in self._all:
+            await conn.close()
+        self._all = []
+        self._created = 0
+        self._idle = asyncio.Queue(maxsize=self.size)
@@ -0,0 +1,172 @@
+import bisect
+import sqlite3
+import threading
+
+from db import STATE_COLUMNS, STATE_FIELDS
+
+
+def state_row(row) -> dict:
+    """Baris drivers (sqlite3.Row / aiosqlite Row / dict) -> dict STATE_FIELDS."""
+    return {field: row[field] for field in STATE_FIELDS}
+
+
+class DriverStateCache:
+    """Salinan state driver di memori, di-index per id dan fingerprint_id.
+
+    Dimuat penuh saat start, lalu setiap endpoint yang mengubah drivers
+    menulis ke SQLite dulu dan menerapkan baris hasil RETURNING ke sini
+    setelah commit (write-through). Bacaan /drivers, /dashboard dan kandidat
+    cek keterlambatan dilayani dari salinan ini tanpa query.
+
+    Setiap UPDATE menaikkan `row_version`, jadi baris yang datang terlambat
+    (mis. dua commit yang diterapkan tidak berurutan) tidak menimpa baris
+    yang lebih baru. Id driver yang benar-benar dihapus diingat agar baris
+    lama yang datang setelah `remove()` tidak menghidupkannya lagi
+    (AUTOINCREMENT tidak memakai ulang id). `check()` membandingkan salinan
+    dengan database dan memperbaiki selisihnya.
+
+    Dict yang dikembalikan dipakai bersama: jangan diubah.
+    """
+
+    def __init__(self):
+        self._by_id = {}
+        self._by_fp = {}
+        # id terurut untuk keyset pagination
+        self._ids = []
+        # id -> urutan remove(); dibandingkan dengan awal snapshot check()
+        self._deleted = {}
+        self._removals = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def load(self, conn: sqlite3.Connection):
+        """Bangun ulang seluruh salinan dari database."""
+        rows = [state_row(row) for row in conn.execute(f"SELECT {STATE_COLUMNS} FROM drivers ORDER BY id")]
+        with self._lock:
+            self._by_id = {row["id"]: row for row in rows}
+            self._by_fp = {row["fingerprint_id"]: row for row in rows if row["fingerprint_id"] is not None}
+            self._ids = [row["id"] for row in rows]
+            self._deleted = {}
+
+    def _set(self, row: dict):
+        current = self._by_id.get(row["id"])
+        if current is None:
+            bisect.insort(self._ids, row["id"])
+        elif current["fingerprint_id"] != row["fingerprint_id"] and \
+                self._by_fp.get(current["fingerprint_id"]) is current:
+            del self._by_fp[current["fingerprint_id"]]
+        self._by_id[row["id"]] = row
+        if row["fingerprint_id"] is not None:
+            self._by_fp[row["fingerprint_id"]] = row
+
+    def _drop(self, driver_id: int):
+        row = self._by_id.pop(driver_id, None)
+        if row is None:
+            return
+        del self._ids[bisect.bisect_left(self._ids, driver_id)]
+        if self._by_fp.get(row["fingerprint_id"]) is row:
+            del self._by_fp[row["fingerprint_id"]]
+
+    def apply(self, rows):
+        """Terapkan baris yang baru di-commit (hasil RETURNING atau SELECT ulang)."""
+        rows = [state_row(row) for row in rows]
+        with self._lock:
+            for row in rows:
+                if row["id"] in self._deleted:
+                    continue
+                current = self._by_id.get(row["id"])
+                if current is not None and current["row_version"] > row["row_version"]:
+                    continue
+                self._set(row)
+
+    def remove(self, driver_id: int):
+        """Dipanggil hanya jika DELETE benar-benar menghapus baris."""
+        with self._lock:
+            self._removals += 1
+            self._deleted[driver_id] = self._removals
+            self._drop(driver_id)
+
+    def get(self, driver_id: int):
+        return self._by_id.get(driver_id)
+
+    def by_fingerprint(self, fingerprint_id: int):
+        return self._by_fp.get(fingerprint_id)
+
+    def max_id(self) -> int:
+        with self._lock:
+            return self._ids[-1] if self._ids else 0
+
+    def max_fingerprint_id(self) -> int:
+        """Slot sensor terbesar yang dipakai; bisa berbeda dari id driver."""
+        with self._lock:
+            return max(self._by_fp, default=0)
+
+    def select(self, after_id: int = None, status: str = None, limit: int = None) -> list:
+        """Driver urut id, dengan filter yang sama seperti GET /drivers."""
+        with self._lock:
+            start = bisect.bisect_right(self._ids, after_id) if after_id is not None else 0
+            rows = []
+            for driver_id in self._ids[start:]:
+                row = self._by_id[driver_id]
+                if status is not None and row["status"] != status:
+                    continue
+                rows.append(row)
+                if limit is not None and len(rows) == limit:
+                    break
+            return rows
+
+    def late_candidates(self, cutoff: int) -> list:
+        """Driver JALAN yang belum diberi notifikasi dan mulai paling lambat `cutoff`."""
+        with self._lock:
+            return [
+                row for row in self._by_id.values()
+                if row["status"] == "JALAN" and not row["late_notified"]
+                and row["delivery_start_epoch"] is not None and row["delivery_start_epoch"] <= cutoff
+            ]
+
+    def check(self, conn: sqlite3.Connection, repair: bool = True) -> dict:
+        """Bandingkan salinan dengan database; jika `repair`, perbaiki selisihnya.
+
+        stale: salinan lebih lama dari database (write-through terlewat).
+        mismatched: versi sama tapi isi berbeda (database diubah di luar API).
+        missing / extra: driver hanya ada di database / hanya di salinan.
+        Baris di salinan yang lebih baru dari snapshot tidak dihitung.
+        """
+        with self._lock:
+            started = self._removals
+        snapshot = {
+            row["id"]: state_row(row)
+            for row in conn.execute(f"SELECT {STATE_COLUMNS} FROM drivers ORDER BY id")
+        }
+        # Driver yang dibuat setelah snapshot punya id lebih besar (AUTOINCREMENT)
+        last_id = max(snapshot, default=0)
+        report = {"checked": len(snapshot), "stale": [], "mismatched": [], "missing": [], "extra": []}
+        with self._lock:
+            for driver_id, row in snapshot.items():
+                current = self._by_id.get(driver_id)
+                if current is None:
+                    # remove() setelah snapshot dimulai: DELETE mungkin belum
+                    # terlihat di snapshot. Tombstone yang lebih lama tidak
+                    # berlaku lagi karena baris ini ada di database.
+                    if self._deleted.get(driver_id, 0) > started:
+                        continue
+                    report["missing"].append(driver_id)
+                elif current["row_version"] < row["row_version"]:
+                    report["stale"].append(driver_id)
+                elif current["row_version"] == row["row_version"] and current != row:
+                    report["mismatched"].append(driver_id)
+                else:
+                    continue
+                if repair:
+                    self._deleted.pop(driver_id, None)
+                    self._set(row)
+            for driver_id in self._ids:
+                if driver_id <= last_id and driver_id not in snapshot:
+                    report["extra"].append(driver_id)
+            if repair:
+                for driver_id in report["extra"]:
+                    self._drop(driver_id)
+        report["consistent"] = not any(report[key] for key in ("stale", "mismatched", "missing", "extra"))
+        return report
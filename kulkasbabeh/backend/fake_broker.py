@@ -0,0 +1,98 @@
+"""Broker AMQP palsu di memori untuk benchmark dan pengujian lokal.
+
+Meniru bagian BlockingConnection/BlockingChannel pika yang dipakai oleh
+AlertPublisher. Latensi handshake dan round-trip bisa diatur, dan
+kegagalan koneksi bisa disuntikkan lewat `fail_next`.
+"""
+import threading
+import time
+
+from pika.exceptions import AMQPConnectionError, StreamLostError
+
+
+class FakeChannel:
+    def __init__(self, broker, connection):
+        self.broker = broker
+        self.connection = connection
+        self._pending = []
+        self.is_open = True
+
+    def _check(self):
+        if not self.connection.is_open:
+            raise StreamLostError("connection lost")
+
+    def queue_declare(self, queue, durable=False):
+        self._check()
+        self.broker._round_trip()
+        self.broker.queues.setdefault(queue, [])
+
+    def tx_select(self):
+        self._check()
+        self.broker._round_trip()
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self._check()
+        self._pending.append((routing_key, body))
+
+    def tx_commit(self):
+        self._check()
+        self.broker._round_trip()
+        with self.broker.lock:
+            for routing_key, body in self._pending:
+                self.broker.queues.setdefault(routing_key, []).append(body)
+        self.broker.commits += 1
+        self._pending = []
+
+    def close(self):
+        self.is_open = False
+
+
+class FakeConnection:
+    def __init__(self, broker):
+        self.broker = broker
+        self.is_open = True
+
+    def channel(self):
+        self.broker._round_trip()
+        return FakeChannel(self.broker, self)
+
+    def close(self):
+        self.is_open = False
+
+
+class FakeBroker:
+    """Dipanggil seperti connection factory: `FakeBroker()()` -> koneksi."""
+
+    def __init__(self, connect_latency: float = 0.0, rtt: float = 0.0):
+        self.connect_latency = connect_latency
+        self.rtt = rtt
+        self.queues = {}
+        self.connections = 0
+        self.commits = 0
+        self.fail_next = 0
+        self.lock = threading.Lock()
+        self._live = []
+
+    def _round_trip(self):
+        if self.rtt:
+            time.sleep(self.rtt)
+
+    def __call__(self):
+        if self.fail_next:
+            self.fail_next -= 1
+            raise AMQPConnectionError("fake broker unavailable")
+        if self.connect_latency:
+            time.sleep(self.connect_latency)
+        self.connections += 1
+        connection = FakeConnection(self)
+        self._live.append(connection)
+        return connection
+
+    def drop_connections(self):
+        """Putuskan semua koneksi aktif (simulasi broker restart)."""
+        for connection in self._live:
+            connection.close()
+        self._live = []
+
+    def messages(self, queue: str) -> list:
+        return list(self.queues.get(queue, []))
@@ -0,0 +1,332 @@
+"""Load test HTTP backend untuk jalur scan -> status.
+
+Dua skenario:
+  saturate  N client tanpa jeda: scan fingerprint + baca /drivers
+            (mengukur throughput maksimum).
+  fleet     simulasi pemakaian nyata: --devices ESP32 yang scan dengan
+            jeda acak (rata-rata --scan-interval detik), --dashboards yang
+            polling /drivers, /dashboard dan /sync, serta --operators yang
+            menjalankan enroll/delete lengkap dengan long-poll hasilnya
+            (ESP32 disimulasikan melapor setelah --esp-delay detik).
+
+Server:
+  default       uvicorn di subprocess dengan database sementara.
+  --in-process  app diimpor langsung (httpx ASGITransport) dengan database
+                sementara dan FakeBroker sebagai RabbitMQ; sebagian driver
+                dibuat terlambat agar cek keterlambatan + outbox ikut jalan.
+  --url         server yang sudah berjalan (database harus kosong).
+
+Untuk membandingkan dengan versi lain, simpan hasil dengan --save lalu
+jalankan versi lain (mis. --app-dir ke checkout lain) dengan --baseline.
+Hasil satu run bisa berbeda +-25% (terutama di mesin 1 CPU, karena client
+dan server berbagi core); pakai --repeat untuk median beberapa run, masing-
+masing dengan server uvicorn dan database baru (hanya mode default).
+
+Contoh:
+    python loadtest.py --clients 200 --duration 20 --repeat 5 --save after.json
+    python loadtest.py --scenario fleet --in-process --devices 100 --save fleet.json
+    git worktree add /tmp/before <commit> &&
+        python loadtest.py --app-dir /tmp/before/kulkasbabeh/backend --baseline after.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import httpx
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def spawn_server(app_dir: str):
+    """Jalankan uvicorn di subprocess dengan database sementara."""
+    port = free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DB_PATH=os.path.join(tmp, "drivers.db"))
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", os.path.abspath(app_dir),
+             "--port", str(port), "--log-level", "warning"],
+            cwd=tmp, env=env,
+        )
+        url = f"http://127.0.0.1:{port}"
+        try:
+            deadline = time.time() + 20
+            while True:
+                try:
+                    httpx.get(f"{url}/docs", timeout=1)
+                    break
+                except httpx.HTTPError:
+                    if time.time() > deadline or process.poll() is not None:
+                        raise RuntimeError("server failed to start")
+                    time.sleep(0.2)
+            yield url
+        finally:
+            process.terminate()
+            process.wait()
+
+
+@asynccontextmanager
+async def in_process_app(app_dir: str, broker_rtt: float):
+    """Impor main.py dengan database sementara dan FakeBroker, jalankan lifespan-nya."""
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DB_PATH"] = os.path.join(tmp, "drivers.db")
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        os.environ.setdefault("SYNC_INTERVAL_SECONDS", "2")
+        os.environ.setdefault("MQTT_ENABLED", "0")
+        sys.path.insert(0, os.path.abspath(app_dir))
+        import main
+        from fake_broker import FakeBroker
+
+        broker = FakeBroker(rtt=broker_rtt)
+        main.alert_publisher.connection_factory = broker
+        async with main.lifespan(main.app):
+            yield main, broker
+        main.pool.close()
+
+
+def summarize(latencies: list, duration: float) -> dict:
+    latencies = sorted(latencies)
+    q = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / duration,
+        "p50_ms": q[49] * 1000,
+        "p95_ms": q[94] * 1000,
+        "p99_ms": q[98] * 1000,
+    }
+
+
+def median_results(runs: list) -> dict:
+    """Median per operasi dan per angka dari beberapa run."""
+    merged = {}
+    for name in runs[0]:
+        values = [run[name] for run in runs if name in run]
+        merged[name] = {key: statistics.median(v[key] for v in values) for key in values[0]}
+    return merged
+
+
+def print_report(results: dict, baseline: dict = None):
+    for name, r in results.items():
+        line = (f"{name:<20} n={int(r['requests']):<7} {r['rps']:8.1f} req/s  "
+                f"p50={r['p50_ms']:8.2f}ms  p95={r['p95_ms']:8.2f}ms  p99={r['p99_ms']:8.2f}ms")
+        if baseline and name in baseline:
+            b = baseline[name]
+            line += f"  | rps x{r['rps'] / b['rps']:.2f}  p99 x{r['p99_ms'] / b['p99_ms']:.2f}"
+        print(line)
+
+
+async def seed(client: httpx.AsyncClient, n_drivers: int):
+    for i in range(1, n_drivers + 1):
+        r = await client.post("/drivers", json={"name": f"Driver {i}", "fingerprint_id": i, "phone_number": f"628{i:09d}"})
+        r.raise_for_status()
+
+
+class Recorder:
+    """Latensi per nama operasi; request gagal (status >= 400 / error) dihitung terpisah."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = 0
+
+    async def timed(self, name: str, request):
+        start = time.perf_counter()
+        try:
+            response = await request
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            response, ok = None, False
+        if ok:
+            self.latencies.setdefault(name, []).append(time.perf_counter() - start)
+        else:
+            self.errors += 1
+        return response
+
+    def results(self, duration: float) -> dict:
+        results = {name: summarize(values, duration) for name, values in self.latencies.items()}
+        results["total"] = summarize([v for values in self.latencies.values() for v in values], duration)
+        results["total"]["errors"] = self.errors
+        return results
+
+
+async def saturate(client: httpx.AsyncClient, args, recorder: Recorder):
+    deadline = time.perf_counter() + args.duration
+
+    async def worker(seed_value: int):
+        rng = random.Random(seed_value)
+        while time.perf_counter() < deadline:
+            if rng.random() < args.read_ratio:
+                await recorder.timed("read_drivers", client.get("/drivers"))
+            else:
+                fp = rng.randint(1, args.drivers)
+                await recorder.timed("scan", client.post(f"/drivers/{fp}"))
+
+    await asyncio.gather(*(worker(i) for i in range(args.clients)))
+
+
+async def fleet(client: httpx.AsyncClient, args, recorder: Recorder):
+    deadline = time.perf_counter() + args.duration
+
+    async def pause(rng: random.Random, mean: float):
+        # Jeda acak (eksponensial), dipotong di akhir durasi
+        await asyncio.sleep(min(rng.expovariate(1 / mean), max(deadline - time.perf_counter(), 0)))
+
+    async def device(seed_value: int):
+        rng = random.Random(seed_value)
+        while time.perf_counter() < deadline:
+            await pause(rng, args.scan_interval)
+            fp = rng.randint(1, args.drivers)
+            await recorder.timed("scan", client.post(f"/drivers/{fp}"))
+
+    async def dashboard(seed_value: int):
+        rng = random.Random(seed_value)
+        while time.perf_counter() < deadline:
+            await recorder.timed("read_drivers", client.get("/drivers"))
+            await recorder.timed("dashboard", client.get("/dashboard"))
+            await recorder.timed("read_sync", client.get("/sync"))
+            await pause(rng, args.poll_interval)
+
+    async def esp_report(path: str, fingerprint_id: int):
+        await asyncio.sleep(args.esp_delay)
+        await recorder.timed("esp_report", client.post(path, json={"id": fingerprint_id, "status": "success"}))
+
+    async def operation(kind: str, fingerprint_id: int):
+        report = asyncio.create_task(esp_report(f"/{kind}/status", fingerprint_id))
+        response = await recorder.timed(
+            f"{kind}_wait", client.get(f"/{kind}/status/wait/{fingerprint_id}", params={"timeout": 10})
+        )
+        await report
+        if response is not None and not response.json():
+            recorder.errors += 1  # timeout tanpa hasil
+
+    async def operator(seed_value: int):
+        rng = random.Random(seed_value)
+        while time.perf_counter() < deadline:
+            response = await recorder.timed("next_id", client.post("/drivers/next_id"))
+            if response is not None:
+                await operation("enroll", response.json()["next_id"])
+            # Tanpa /delete/{id}/start: perintah MQTT ke ESP32 tidak
+            # disimulasikan, hanya laporan hasil + long-poll-nya
+            await operation("delete", rng.randint(1, args.drivers))
+            await pause(rng, args.poll_interval)
+
+    await asyncio.gather(
+        *(device(i) for i in range(args.devices)),
+        *(dashboard(10_000 + i) for i in range(args.dashboards)),
+        *(operator(20_000 + i) for i in range(args.operators)),
+    )
+
+
+async def run(client: httpx.AsyncClient, args) -> dict:
+    recorder = Recorder()
+    started = time.perf_counter()
+    await (fleet if args.scenario == "fleet" else saturate)(client, args, recorder)
+    return recorder.results(time.perf_counter() - started)
+
+
+async def run_http(url: str, args) -> dict:
+    connections = max(args.clients, args.devices + args.dashboards + 2 * args.operators)
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        await seed(client, args.drivers)
+        return await run(client, args)
+
+
+async def run_in_process(args) -> dict:
+    async with in_process_app(args.app_dir, args.broker_rtt) as (main, broker):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=60) as client:
+            await seed(client, args.drivers)
+            # Sebagian driver sudah JALAN lebih dari 2 jam: cek keterlambatan
+            # menandai mereka dan outbox mengirim alert ke FakeBroker
+            late = int(args.drivers * args.late_ratio)
+            with main.pool.connection() as conn:
+                conn.execute("""
+                    UPDATE drivers SET status = 'JALAN',
+                        delivery_start_epoch = CAST(strftime('%s', 'now') AS INTEGER) - 7200
+                    WHERE id <= ?
+                """, (late,))
+                conn.commit()
+                # Ditulis langsung ke database, jadi salinan di memori
+                # dimuat ulang (versi lama belum punya driver_state)
+                if hasattr(main, "driver_state"):
+                    main.driver_state.load(conn)
+            main.lateness_task.trigger()
+
+            results = await run(client, args)
+        print(f"fake broker: {broker.commits} commits, {sum(len(q) for q in broker.queues.values())} messages")
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=("saturate", "fleet"), default="saturate")
+    parser.add_argument("--url", help="server yang sudah berjalan (database harus kosong)")
+    parser.add_argument("--in-process", action="store_true", help="jalankan app di proses ini dengan FakeBroker")
+    parser.add_argument("--app-dir", default=os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--drivers", type=int, default=200)
+    # saturate
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--read-ratio", type=float, default=0.2)
+    # fleet
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--scan-interval", type=float, default=2.0, help="rata-rata jeda scan per device (detik)")
+    parser.add_argument("--dashboards", type=int, default=10)
+    parser.add_argument("--poll-interval", type=float, default=3.0, help="rata-rata jeda polling dashboard/operator (detik)")
+    parser.add_argument("--operators", type=int, default=4)
+    parser.add_argument("--esp-delay", type=float, default=0.5)
+    # in-process
+    parser.add_argument("--broker-rtt", type=float, default=0.002)
+    parser.add_argument("--late-ratio", type=float, default=0.1)
+    parser.add_argument("--repeat", type=int, default=1, help="jumlah run; hasil = median per angka")
+    parser.add_argument("--save", help="simpan hasil ke file JSON")
+    parser.add_argument("--baseline", help="bandingkan dengan hasil JSON sebelumnya")
+    args = parser.parse_args()
+
+    if args.url and args.repeat > 1:
+        parser.error("--repeat needs a fresh database per run; not supported with --url")
+    if args.in_process and args.repeat > 1:
+        # main hanya diimpor sekali per proses: run kedua memakai DB_PATH
+        # (dan thread latar) milik run pertama
+        parser.error("--repeat needs a fresh server per run; not supported with --in-process")
+
+    runs = []
+    for _ in range(args.repeat):
+        # Dengan --repeat hanya mode default: setiap run memakai server dan
+        # database baru
+        if args.in_process:
+            runs.append(asyncio.run(run_in_process(args)))
+        elif args.url:
+            runs.append(asyncio.run(run_http(args.url, args)))
+        else:
+            with spawn_server(args.app_dir) as url:
+                runs.append(asyncio.run(run_http(url, args)))
+        if args.repeat > 1:
+            print(f"run {len(runs)}: {runs[-1]['total']['rps']:.1f} req/s  p99={runs[-1]['total']['p99_ms']:.2f}ms")
+    results = median_results(runs)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,121 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError
 from typing import List, Optional
-from datetime import datetime, time
+from datetime import date, datetime, time, timedelta
+import os
 import sqlite3
-import pika
+import asyncio
 import json
-from queue import Queue
-
-app = FastAPI()
-DB_PATH = "drivers.db"
-conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-cursor = conn.cursor()
-
-# Queue global untuk komunikasi ESP → Streamlit
-enroll_status_queue = Queue()
-delete_status_queue = Queue()
-
-# Tambahkan kolom phone_number jika belum ada
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS drivers (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    name TEXT NOT NULL,
-    fingerprint_id INTEGER,
-    status TEXT CHECK(status IN ('STAY', 'JALAN', 'OFF')) NOT NULL DEFAULT 'OFF',
-    delivery_start TEXT,
-    phone_number TEXT
+import csv
+import io
+import logging
+from contextlib import asynccontextmanager
+
+from db_async import AsyncConnectionPool
+from db import ConnectionPool, migrate, to_epoch, DRIVER_FIELDS, STATE_COLUMNS, SCAN_TOGGLE_SQL, SCAN_OFF_SQL
+from scheduler import PeriodicTask
+from publisher import AlertPublisher
+from outbox import AlertOutbox
+from operations import OperationRegistry
+from cache import VersionedResponseCache
+from broadcast import StatusBroadcaster
+from thresholds import LatenessRules
+from driver_state import DriverStateCache
+from mqtt_bridge import MqttBridge
+from scan_ingest import ScanBatcher
+from scan_dedup import ScanDedup, DUPLICATE, JOINED
+import metrics
+from metrics import MetricsMiddleware
+
+# Level log lewat env LOG_LEVEL (DEBUG menampilkan setiap pesan WA terkirim)
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
 )
-''')
-# Periksa dan tambahkan kolom phone_number jika tidak ada (untuk update database lama)
-try:
-    cursor.execute("ALTER TABLE drivers ADD COLUMN phone_number TEXT")
-except sqlite3.OperationalError:
-    pass  # kolom sudah ada
-conn.commit()
-
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS admins (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    name TEXT NOT NULL,
-    phone_number TEXT NOT NULL
+logger = logging.getLogger("kulkasbabeh")
+
+REQUEST_SECONDS = metrics.histogram("http_request_seconds", "Latensi request per route", ("method", "route", "status"))
+DB_QUERY_SECONDS = metrics.histogram("db_query_seconds", "Durasi query database di jalur utama", ("query",))
+LATENESS_SCANNED = metrics.counter("lateness_drivers_scanned_total", "Driver kandidat yang diperiksa cek keterlambatan")
+LATENESS_LATE = metrics.counter("lateness_late_drivers_total", "Driver yang ditandai terlambat")
+SCAN_DUPLICATES = metrics.counter("scan_duplicates_total", "Scan duplikat yang tidak ditulis ke database",
+                                  ("path", "kind"))
+STATE_DRIFT = metrics.counter("driver_state_drift_total", "Selisih salinan driver di memori dengan database", ("kind",))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Cek keterlambatan dan pengiriman WA berjalan di background, tidak
+    # bergantung pada dashboard yang sedang terbuka
+    broadcaster.bind(asyncio.get_running_loop())
+    lateness_task.start()
+    alert_dispatcher.start()
+    driver_state_task.start()
+    if MQTT_ENABLED:
+        scan_batcher.start()
+        mqtt_bridge.start()
+    yield
+    if MQTT_ENABLED:
+        mqtt_bridge.stop()
+        scan_batcher.stop()
+    await lateness_task.stop()
+    await alert_dispatcher.stop()
+    await driver_state_task.stop()
+    await async_pool.close()
+    alert_publisher.close()
+
+
+app = FastAPI(lifespan=lifespan)
+DB_PATH = os.getenv("DB_PATH", "drivers.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+pool = ConnectionPool(DB_PATH, size=DB_POOL_SIZE)
+# Endpoint dengan trafik tinggi (scan, baca dashboard) memakai pool async
+# agar tidak bersaing di threadpool Starlette
+async_pool = AsyncConnectionPool(DB_PATH, size=DB_POOL_SIZE)
+
+# Cache /drivers dan /admins; versi dinaikkan oleh setiap endpoint tulis
+response_cache = VersionedResponseCache()
+# Subscriber WebSocket /ws/status
+broadcaster = StatusBroadcaster(buffer_size=int(os.getenv("WS_BUFFER_SIZE", "100")))
+
+
+def data_changed(event: Optional[dict] = None):
+    """Dipanggil setelah commit oleh setiap endpoint yang mengubah drivers."""
+    response_cache.bump()
+    # Selain event status, client cukup diberi tahu untuk menarik delta
+    broadcaster.publish(event or {"type": "changed"})
+
+# Scan duplikat (jari ditempel dua kali / retry firmware) dibalas dengan
+# hasil sebelumnya tanpa menyentuh database (lihat scan_dedup.py)
+scan_dedup = ScanDedup(
+    window=float(os.getenv("SCAN_DEBOUNCE_SECONDS", "3")),
+    key_ttl=float(os.getenv("SCAN_IDEMPOTENCY_TTL_SECONDS", "60")),
+    max_entries=int(os.getenv("SCAN_DEDUP_MAX_ENTRIES", "1000"))
 )
-''')
-conn.commit()
+# Batas tunggu scan HTTP yang digabung ke scan yang sedang berjalan
+SCAN_JOIN_TIMEOUT_SECONDS = float(os.getenv("SCAN_JOIN_TIMEOUT_SECONDS", "5"))
+
+# Hasil operasi ESP → Streamlit, dikunci per fingerprint id (lihat operations.py)
+OPERATION_TTL_SECONDS = float(os.getenv("OPERATION_TTL_SECONDS", "120"))
+enroll_results = OperationRegistry(ttl=OPERATION_TTL_SECONDS)
+delete_results = OperationRegistry(ttl=OPERATION_TTL_SECONDS)
+# Fingerprint id yang sudah dibagikan POST /drivers/next_id. Dilepas saat
+# driver dengan id itu dibuat (bukan saat ESP32 selesai enroll), atau
+# kedaluwarsa jika enrollment ditinggalkan.
+ID_RESERVATION_TTL_SECONDS = float(os.getenv("ID_RESERVATION_TTL_SECONDS", "300"))
+reserved_ids = OperationRegistry(ttl=ID_RESERVATION_TTL_SECONDS)
+
+# Buat / perbarui skema database (lihat MIGRATIONS di db.py)
+with pool.connection() as conn:
+    migrate(conn)
+
+# State driver di memori (lihat driver_state.py): setiap endpoint tulis
+# menerapkan baris hasil RETURNING setelah commit
+driver_state = DriverStateCache()
+with pool.connection() as conn:
+    driver_state.load(conn)
 
 # Configure CORS
 origins = [
@@ -59,11 +132,30 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Ditambahkan terakhir = lapisan terluar, jadi waktu CORS ikut terukur
+app.add_middleware(MetricsMiddleware, histogram=REQUEST_SECONDS)
+
+# Jumlah operasi ESP32 yang sedang berjalan dan client yang menunggu hasilnya
+metrics.gauge("operations_pending", "Entri di registry operasi enroll/delete", ("registry",),
+              callback=lambda: {("enroll",): len(enroll_results), ("delete",): len(delete_results)})
+metrics.gauge("operations_waiters", "Client long-poll yang menunggu hasil operasi", ("registry",),
+              callback=lambda: {("enroll",): enroll_results.waiting(), ("delete",): delete_results.waiting()})
+metrics.gauge("websocket_subscribers", "Client yang terhubung ke /ws/status",
+              callback=lambda: {(): len(broadcaster)})
+metrics.gauge("scan_dedup_entries", "Hasil scan yang disimpan untuk deteksi duplikat",
+              callback=lambda: {(): len(scan_dedup)})
+metrics.gauge("driver_state_entries", "Driver di salinan state memori",
+              callback=lambda: {(): len(driver_state)})
 
 def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    # Pinjam koneksi dari pool, otomatis dikembalikan setelah blok `with`
+    return pool.connection()
+
+def get_async_db():
+    # Untuk handler `async def`: `async with get_async_db() as conn`
+    return async_pool.connection()
+
+STATUSES = ("STAY", "JALAN", "OFF")
 
 class Driver(BaseModel):
     id: Optional[int] = None
@@ -90,140 +182,308 @@ class DeletionStatus(BaseModel):
     status: str  # "success" or "failed"
     reason: str | None = None
 
+class Zone(BaseModel):
+    id: Optional[int] = None
+    name: str
+    threshold_minutes: Optional[int] = None  # None = pakai default
+
+class DriverThreshold(BaseModel):
+    zone_id: Optional[int] = None
+    late_threshold_minutes: Optional[int] = None  # None = ikut zona / default
+
+class BulkStatusUpdate(BaseModel):
+    status: str
+    driver_ids: Optional[List[int]] = None  # None = semua driver
+
 
 @app.get("/drivers", response_model=List[Driver])
-def read_drivers():
-    conn = get_db()
-    cursor = conn.cursor()
-    drivers = cursor.execute("SELECT * FROM drivers").fetchall()
-    conn.close()
-    return [dict(d) for d in drivers]
+async def read_drivers(
+    request: Request,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=5000),
+    status: Optional[str] = None,
+    fields: Optional[str] = None,
+    format: str = "json"
+):
+    # Dilayani dari driver_state tanpa query database.
+    # Tanpa parameter: seluruh tabel, di-cache per versi data (ETag).
+    # Dengan parameter: keyset pagination (after_id + limit), filter status,
+    # proyeksi kolom (fields=id,name), dan format=ndjson untuk streaming.
+    # Jika halaman penuh, header X-Next-After-Id berisi cursor berikutnya.
+    columns = list(DRIVER_FIELDS)
+    if fields:
+        columns = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = set(columns) - set(DRIVER_FIELDS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    if format not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be json or ndjson")
+    if status is not None and status not in STATUSES:
+        raise HTTPException(status_code=400, detail=f"status must be one of {', '.join(STATUSES)}")
+
+    def project(row) -> dict:
+        return {field: row[field] for field in columns}
+
+    if format == "ndjson":
+        drivers = driver_state.select(after_id, status, limit)
+        return StreamingResponse(
+            (json.dumps(project(d)) + "\n" for d in drivers), media_type="application/x-ndjson"
+        )
+
+    page = {}
+
+    async def build():
+        drivers = driver_state.select(after_id, status, limit)
+        if limit is not None and len(drivers) == limit:
+            page["next_after_id"] = drivers[-1]["id"]
+        return [project(d) for d in drivers]
+
+    if request.query_params:
+        # Halaman/filter tidak disimpan di cache body; ETag tetap berlaku
+        response = await response_cache.respond_async(request, None, build)
+    else:
+        response = await response_cache.respond_async(request, "drivers", build)
+    if "next_after_id" in page:
+        response.headers["X-Next-After-Id"] = str(page["next_after_id"])
+    return response
 
 @app.get("/admins", response_model=List[Admin])
-def read_admins():
-    conn = get_db()
-    cursor = conn.cursor()
-    admins = cursor.execute("SELECT * FROM admins").fetchall()
-    conn.close()
-    return [dict(a) for a in admins]
+async def read_admins(request: Request):
+    async def build():
+        async with get_async_db() as conn:
+            admins = await conn.execute_fetchall("SELECT id, name, phone_number FROM admins")
+            return [dict(a) for a in admins]
+    return await response_cache.respond_async(request, "admins", build)
 
 @app.post("/drivers", response_model=Driver)
 def create_driver(driver: Driver):
     status = "OFF"
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO drivers (name, fingerprint_id, status, delivery_start, phone_number)
-        VALUES (?, ?, ?, ?, ?)
-    """, (driver.name, driver.fingerprint_id, status, None, driver.phone_number))
-    conn.commit()
-    driver.id = cursor.lastrowid
-    driver.status = status
-    conn.close()
-    return driver
+    with get_db() as conn:
+        cursor = conn.cursor()
+        try:
+            row = cursor.execute(f"""
+                INSERT INTO drivers (name, fingerprint_id, status, delivery_start, phone_number)
+                VALUES (?, ?, ?, ?, ?)
+                RETURNING {STATE_COLUMNS}
+            """, (driver.name, driver.fingerprint_id, status, None, driver.phone_number)).fetchone()
+        except sqlite3.IntegrityError as e:
+            # mis. fingerprint_id sudah dipakai driver lain
+            raise HTTPException(status_code=409, detail=str(e))
+        conn.commit()
+        driver_state.apply([row])
+        reserved_ids.discard(driver.fingerprint_id)
+        data_changed()
+        driver.id = row["id"]
+        driver.status = status
+        return driver
+
+@app.post("/drivers/bulk")
+async def create_drivers_bulk(request: Request):
+    # Import banyak driver dalam satu transaksi. Body berupa JSON list
+    # atau CSV (Content-Type: text/csv) dengan header
+    # name,fingerprint_id,phone_number
+    body = await request.body()
+    try:
+        if request.headers.get("content-type", "").startswith("text/csv"):
+            rows = [
+                {key: value or None for key, value in row.items()}
+                for row in csv.DictReader(io.StringIO(body.decode("utf-8-sig")))
+            ]
+        else:
+            rows = json.loads(body)
+        drivers = [Driver(**row) for row in rows]
+    except (ValueError, TypeError, ValidationError) as e:
+        raise HTTPException(status_code=422, detail=f"Invalid driver data: {e}")
+
+    async with get_async_db() as conn:
+        # IMMEDIATE: tidak ada insert lain di antara MAX(id) dan executemany,
+        # jadi baris baru = id > last_id
+        await conn.execute("BEGIN IMMEDIATE")
+        last_id = (await conn.execute_fetchall("SELECT COALESCE(MAX(id), 0) FROM drivers"))[0][0]
+        try:
+            await conn.executemany("""
+                INSERT INTO drivers (name, fingerprint_id, status, delivery_start, phone_number)
+                VALUES (?, ?, 'OFF', NULL, ?)
+            """, [(d.name, d.fingerprint_id, d.phone_number) for d in drivers])
+        except sqlite3.IntegrityError as e:
+            # Seluruh batch dibatalkan (rollback saat koneksi dikembalikan)
+            raise HTTPException(status_code=409, detail=str(e))
+        created = await conn.execute_fetchall(
+            f"SELECT {STATE_COLUMNS} FROM drivers WHERE id > ? ORDER BY id", (last_id,)
+        )
+        await conn.commit()
+    driver_state.apply(created)
+    data_changed()
+    return {"created": len(drivers)}
+
+@app.get("/drivers/export")
+async def export_drivers(format: str = "csv"):
+    # Streaming langsung dari cursor; tabel tidak pernah dimuat utuh
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+
+    async def rows():
+        if format == "csv":
+            yield ",".join(DRIVER_FIELDS) + "\n"
+        async with get_async_db() as conn:
+            async with conn.execute(f"SELECT {', '.join(DRIVER_FIELDS)} FROM drivers ORDER BY id") as cursor:
+                async for row in cursor:
+                    if format == "csv":
+                        line = io.StringIO()
+                        csv.writer(line, lineterminator="\n").writerow(tuple(row))
+                        yield line.getvalue()
+                    else:
+                        yield json.dumps(dict(row)) + "\n"
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(rows(), media_type=media_type, headers={
+        "Content-Disposition": f"attachment; filename=drivers.{format}"
+    })
+
+@app.post("/drivers/status/bulk")
+async def update_driver_status_bulk(update: BulkStatusUpdate):
+    # Mis. reset akhir shift: {"status": "OFF"} untuk semua driver
+    if update.status not in STATUSES:
+        raise HTTPException(status_code=400, detail=f"status must be one of {', '.join(STATUSES)}")
+    now = datetime.now()
+    delivery_start = now.isoformat() if update.status == "JALAN" else None
+    delivery_start_epoch = int(now.timestamp()) if update.status == "JALAN" else None
+
+    # Driver yang statusnya sudah sama dilewati
+    sql = """
+        UPDATE drivers
+        SET previous_status = status, status = ?,
+            delivery_start = ?, delivery_start_epoch = ?, late_notified = 0,
+            row_version = row_version + 1
+        WHERE status != ?
+    """
+    params = [update.status, delivery_start, delivery_start_epoch, update.status]
+    if update.driver_ids is not None:
+        if not update.driver_ids:
+            return {"updated": 0}
+        sql += f" AND id IN ({', '.join('?' * len(update.driver_ids))})"
+        params.extend(update.driver_ids)
+    sql += f" RETURNING {STATE_COLUMNS}"
+
+    async with get_async_db() as conn:
+        rows = await conn.execute_fetchall(sql, params)
+        await conn.commit()
+    if rows:
+        driver_state.apply(rows)
+        data_changed()
+    return {"updated": len(rows)}
 
 @app.post("/admins", response_model=Admin)
 def create_admin(admin: Admin):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO admins (name, phone_number)
-        VALUES (?, ?)
-    """, (admin.name, admin.phone_number))
-    conn.commit()
-    admin.id = cursor.lastrowid
-    conn.close()
-    return admin
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO admins (name, phone_number)
+            VALUES (?, ?)
+        """, (admin.name, admin.phone_number))
+        conn.commit()
+        response_cache.bump()
+        admin.id = cursor.lastrowid
+        return admin
 
 @app.put("/drivers/{driver_id}")
 def update_driver(driver_id: int, driver: Driver):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("""
-        UPDATE drivers
-        SET name=?, fingerprint_id=?, status=?, delivery_start=?, phone_number=?
-        WHERE id=?
-    """, (
-        driver.name,
-        driver.fingerprint_id,
-        driver.status,
-        driver.delivery_start,
-        driver.phone_number,
-        driver_id
-    ))
-    conn.commit()
-    conn.close()
-    return {"message": "Driver updated"}
+    with get_db() as conn:
+        cursor = conn.cursor()
+        try:
+            rows = cursor.execute(f"""
+                UPDATE drivers
+                SET name=?, fingerprint_id=?, status=?, phone_number=?,
+                    late_notified = CASE WHEN delivery_start IS ? THEN late_notified ELSE 0 END,
+                    delivery_start=?, delivery_start_epoch=?, row_version = row_version + 1
+                WHERE id=?
+                RETURNING {STATE_COLUMNS}
+            """, (
+                driver.name,
+                driver.fingerprint_id,
+                driver.status,
+                driver.phone_number,
+                driver.delivery_start,
+                driver.delivery_start,
+                to_epoch(driver.delivery_start),
+                driver_id
+            )).fetchall()
+        except sqlite3.IntegrityError as e:
+            # mis. fingerprint_id sudah dipakai driver lain
+            raise HTTPException(status_code=409, detail=str(e))
+        conn.commit()
+        driver_state.apply(rows)
+        data_changed()
+        return {"message": "Driver updated"}
 
 @app.put("/admins/{admin_id}")
 def update_admin(admin_id: int, admin: Admin):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("""
-        UPDATE admins
-        SET name=?, phone_number=?
-        WHERE id=?
-    """, (
-        admin.name,
-        admin.phone_number,
-        admin_id
-    ))
-    conn.commit()
-    conn.close()
-    return {"message": "Admin updated"}
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE admins
+            SET name=?, phone_number=?
+            WHERE id=?
+        """, (
+            admin.name,
+            admin.phone_number,
+            admin_id
+        ))
+        conn.commit()
+        response_cache.bump()
+        return {"message": "Admin updated"}
 
 
 @app.put("/drivers/{driver_id}/status")
 def update_driver_status(driver_id: int, status: str):
-    conn = get_db()
-    cursor = conn.cursor()
-    delivery_start = datetime.now().isoformat() if status == "JALAN" else None
-    cursor.execute("""
-        UPDATE drivers SET status=?, delivery_start=? WHERE id=?
-    """, (status, delivery_start, driver_id))
-    conn.commit()
-    conn.close()
-    return {"message": "Status updated"}
+    with get_db() as conn:
+        cursor = conn.cursor()
+        delivery_start = datetime.now().isoformat() if status == "JALAN" else None
+        rows = cursor.execute(f"""
+            UPDATE drivers
+            SET status=?, delivery_start=?, delivery_start_epoch=?, late_notified=0,
+                row_version = row_version + 1
+            WHERE id=?
+            RETURNING {STATE_COLUMNS}
+        """, (status, delivery_start, to_epoch(delivery_start), driver_id)).fetchall()
+        conn.commit()
+        driver_state.apply(rows)
+        data_changed()
+        return {"message": "Status updated"}
 
 @app.delete("/drivers/{driver_id}")
 def delete_driver(driver_id: int):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM drivers WHERE id=?", (driver_id,))
-    conn.commit()
-    conn.close()
-    return {"message": "Driver deleted"}
+    with get_db() as conn:
+        cursor = conn.cursor()
+        deleted = cursor.execute("DELETE FROM drivers WHERE id=? RETURNING id", (driver_id,)).fetchall()
+        conn.commit()
+        if deleted:
+            driver_state.remove(driver_id)
+            data_changed()
+        return {"message": "Driver deleted"}
 
 @app.delete("/admins/{admin_id}")
 def delete_admin(admin_id: int):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM admins WHERE id=?", (admin_id,))
-    conn.commit()
-    conn.close()
-    return {"message": "Admin deleted"}
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM admins WHERE id=?", (admin_id,))
+        conn.commit()
+        response_cache.bump()
+        return {"message": "Admin deleted"}
 
-@app.post("/drivers/{fingerprint_id}")
-def toggle_driver_status_by_fingerprint(fingerprint_id: int):
-    conn = get_db()
-    cursor = conn.cursor()
-    driver = cursor.execute("SELECT * FROM drivers WHERE fingerprint_id=?", (fingerprint_id,)).fetchone()
-    
-    if not driver:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Driver not found")
-    
-    old_status = driver["status"]
-    new_status = "JALAN" if old_status == "STAY" else "STAY"
-    delivery_start = datetime.now().isoformat() if new_status == "JALAN" else None
+def status_event(driver: sqlite3.Row) -> dict:
+    # Event WebSocket /ws/status: baris driver lengkap agar client bisa
+    # langsung memperbarui salinan lokalnya
+    return {
+        "type": "status",
+        "old_status": driver["previous_status"],
+        "driver": {field: driver[field] for field in DRIVER_FIELDS}
+    }
 
-    cursor.execute(
-        "UPDATE drivers SET status=?, delivery_start=? WHERE id=?",
-        (new_status, delivery_start, driver["id"])
-    )
-    conn.commit()
-    conn.close()
 
+def scan_result(driver: sqlite3.Row) -> dict:
+    old_status = driver["previous_status"]
+    new_status = driver["status"]
     return {
         "message": f"Driver {driver['id']} status updated from {old_status} to {new_status}",
         "driver_id": driver["id"],
@@ -232,172 +492,739 @@ def toggle_driver_status_by_fingerprint(fingerprint_id: int):
         "old_status": old_status,
         "new_status": new_status
     }
-    
-    
-@app.post("/drivers/{fingerprint_id}/OFF")
-def toggle_driver_status_to_off(fingerprint_id: int):
-    conn = get_db()
-    cursor = conn.cursor()
-    driver = cursor.execute("SELECT * FROM drivers WHERE fingerprint_id=?", (fingerprint_id,)).fetchone()
-    
-    if not driver:
-        conn.close()
+
+
+async def scan_fingerprint(fingerprint_id: int, off: bool, idempotency_key: Optional[str]) -> dict:
+    # Satu statement atomik (lihat SCAN_TOGGLE_SQL / SCAN_OFF_SQL), dua scan
+    # yang berdekatan tidak bisa saling menimpa. Fingerprint yang tidak
+    # terdaftar ditolak dari driver_state, dan scan duplikat dijawab
+    # scan_dedup, keduanya tanpa menyentuh database.
+    known = driver_state.by_fingerprint(fingerprint_id)
+    if known is None:
         raise HTTPException(status_code=404, detail="Driver not found")
-    
-    old_status = driver["status"]
-    new_status = "OFF"
-    delivery_start = None
 
-    cursor.execute(
-        "UPDATE drivers SET status=?, delivery_start=? WHERE id=?",
-        (new_status, delivery_start, driver["id"])
-    )
-    conn.commit()
-    conn.close()
+    loop = asyncio.get_running_loop()
+    joined = loop.create_future()
+
+    def wake(result):
+        # Dipanggil dari thread mana pun oleh scan pertama yang sedang berjalan
+        loop.call_soon_threadsafe(lambda: joined.done() or joined.set_result(result))
+
+    state, previous = scan_dedup.begin(fingerprint_id, off, known["row_version"], wake, idempotency_key)
+    if state == DUPLICATE:
+        SCAN_DUPLICATES.inc(path="http", kind="repeat")
+        return {**previous, "duplicate": True}
+    if state == JOINED:
+        SCAN_DUPLICATES.inc(path="http", kind="inflight")
+        try:
+            previous = await asyncio.wait_for(joined, SCAN_JOIN_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            previous = None
+        if previous is None:
+            raise HTTPException(status_code=503, detail="Scan failed, please retry")
+        return {**previous, "duplicate": True}
+
+    # NEW: previous berisi InFlightScan untuk finish()
+    scan, result, driver = previous, None, None
+    try:
+        now = datetime.now()
+        async with get_async_db() as conn:
+            if off:
+                with DB_QUERY_SECONDS.time(query="scan_off"):
+                    rows = await conn.execute_fetchall(SCAN_OFF_SQL, (fingerprint_id,))
+                    await conn.commit()
+            else:
+                with DB_QUERY_SECONDS.time(query="scan_toggle"):
+                    rows = await conn.execute_fetchall(
+                        SCAN_TOGGLE_SQL, (now.isoformat(), int(now.timestamp()), fingerprint_id)
+                    )
+                    await conn.commit()
+
+        if not rows:
+            raise HTTPException(status_code=404, detail="Driver not found")
+        driver = rows[0]
+        driver_state.apply(rows)
+        data_changed(status_event(driver))
+        result = scan_result(driver)
+        return result
+    finally:
+        scan_dedup.finish(scan, result, driver["row_version"] if driver else None)
+
+
+@app.post("/drivers/next_id")
+def reserve_next_driver_id():
+    # Dideklarasikan sebelum POST /drivers/{fingerprint_id} agar path ini
+    # tidak tertangkap route scan. Id yang sedang direservasi enrollment
+    # lain dilewati, lalu id ini direservasi sampai drivernya dibuat.
+    # Dihitung dari fingerprint_id, bukan id driver: keduanya bisa berbeda
+    # setelah bulk import atau PUT yang mengganti fingerprint_id.
+    next_id = max([driver_state.max_fingerprint_id(), *reserved_ids.pending_keys()]) + 1
+    reserved_ids.start(next_id)
+    return {"next_id": next_id}
+
+
+@app.post("/drivers/{fingerprint_id}")
+async def toggle_driver_status_by_fingerprint(fingerprint_id: int, idempotency_key: Optional[str] = Header(None)):
+    # Header Idempotency-Key (opsional): retry dengan key yang sama
+    # mendapat hasil scan pertama
+    return await scan_fingerprint(fingerprint_id, False, idempotency_key)
+
+
+@app.post("/drivers/{fingerprint_id}/OFF")
+async def toggle_driver_status_to_off(fingerprint_id: int, idempotency_key: Optional[str] = Header(None)):
+    return await scan_fingerprint(fingerprint_id, True, idempotency_key)
+
 
-    return {
-        "message": f"Driver {driver['id']} status updated from {old_status} to {new_status}",
-        "driver_id": driver["id"],
-        "driver_name": driver["name"],
-        "phone_number": driver["phone_number"],
-        "old_status": old_status,
-        "new_status": new_status
-    }
-    
-    
 RABBITMQ_HOST = "localhost"
 RABBITMQ_PORT = 5679
 RABBITMQ_USER = "guest"
 RABBITMQ_PASS = "guest"
 QUEUE_NAME = "whatsapp_message_queue"  # Sesuaikan jika teman Anda memberi nama lain
 
-def publish_late_driver(payload: dict):
-    credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
-    parameters = pika.ConnectionParameters(
-        host=RABBITMQ_HOST,
-        port=RABBITMQ_PORT,
-        credentials=credentials
-    )
-    connection = pika.BlockingConnection(parameters)
-    channel = connection.channel()
-    channel.queue_declare(queue=QUEUE_NAME, durable=True)
-
-    message = json.dumps(payload)
-    channel.basic_publish(
-        exchange='',
-        routing_key=QUEUE_NAME,
-        body=message,
-        properties=pika.BasicProperties(delivery_mode=2)  # persistent
-    )
-    connection.close()
+# Satu publisher untuk seluruh proses: koneksi & channel dipakai ulang
+alert_publisher = AlertPublisher.from_params(
+    RABBITMQ_HOST, RABBITMQ_PORT, RABBITMQ_USER, RABBITMQ_PASS, QUEUE_NAME
+)
 
 BOT_NUMBER = "6282387455975"  # Nomor bot WhatsApp
 
 def log_message(payload: dict):
-    print(f"[{datetime.now()}] Sent to {payload['number_recipient']}: {payload['message']}")
+    # Argumen dievaluasi hanya jika level DEBUG aktif
+    logger.debug("Sent to %s: %s", payload["number_recipient"], payload["message"])
 
 
-@app.post("/sync")
-def sync_status(treshold_minutes: int = 45):
-    now = datetime.now()
-    conn = get_db()
-    cursor = conn.cursor()
-
-    # Ambil semua admin
-    admins = cursor.execute("SELECT phone_number FROM admins").fetchall()
-    admin_numbers = [a["phone_number"] for a in admins]
-
-    # Ambil semua driver
-    drivers = cursor.execute("SELECT * FROM drivers").fetchall()
-
-    for d in drivers:
-
-        # Cek keterlambatan
-        if d["delivery_start"]:
-            start_time = datetime.fromisoformat(d["delivery_start"])
-            elapsed = int((now - start_time).total_seconds() / 60)
-            print(f"Elapsed: {elapsed} min")
-            print(f"Treshold: {treshold_minutes} min")
-
-            if elapsed == treshold_minutes:
-                print("⚠️  TERLAMBAT!")
-
-                # Format waktu mulai pengantaran
-                start_time_str = start_time.strftime("%H:%M")
-
-                # Pesan untuk driver
-                msg_driver = (
-                    f"[KAMU MENGANTAR LEBIH LAMA DARI ESTIMASI]\n\n"
-                    f"Halo {d['name']}! Kamu mengantar lebih dari estimasi.\n"
-                    f"Segera konfirmasi ke SPV jika ada kendala di jalan.\n\n"
-                    f"Start pengantaran: {start_time_str}"
-                )
-
-                payload_driver = {
-                    "command": "send_message",
-                    "number": BOT_NUMBER,
-                    "number_recipient": d["phone_number"],
-                    "message": msg_driver
-                }
-                publish_late_driver(payload_driver)
-                log_message(payload_driver)
-
-                # Pesan untuk admin
-                msg_admin = (
-                    f"[ADA DRIVER BELUM KEMBALI]\n\n"
-                    f"Driver {d['name']} belum kembali ke gudang dan sudah lebih dari estimasi waktu yang diberikan.\n\n"
-                    f"Segera follow up ke Driver: {d['phone_number']}\n\n"
-                    f"Start pengantaran: {start_time_str}"
-                )
-
-                for admin_number in admin_numbers:
-                    payload_admin = {
-                        "command": "send_message",
-                        "number": BOT_NUMBER,
-                        "number_recipient": admin_number,
-                        "message": msg_admin
-                    }
-                    publish_late_driver(payload_admin)
-                    log_message(payload_admin)
+def late_driver_payloads(driver: sqlite3.Row, admin_numbers: List[str]) -> List[dict]:
+    # Format waktu mulai pengantaran
+    start_time_str = datetime.fromtimestamp(driver["delivery_start_epoch"]).strftime("%H:%M")
 
+    # Pesan untuk driver
+    msg_driver = (
+        f"[KAMU MENGANTAR LEBIH LAMA DARI ESTIMASI]\n\n"
+        f"Halo {driver['name']}! Kamu mengantar lebih dari estimasi.\n"
+        f"Segera konfirmasi ke SPV jika ada kendala di jalan.\n\n"
+        f"Start pengantaran: {start_time_str}"
+    )
+    payloads = [{
+        "command": "send_message",
+        "number": BOT_NUMBER,
+        "number_recipient": driver["phone_number"],
+        "message": msg_driver
+    }]
+
+    # Pesan untuk admin
+    msg_admin = (
+        f"[ADA DRIVER BELUM KEMBALI]\n\n"
+        f"Driver {driver['name']} belum kembali ke gudang dan sudah lebih dari estimasi waktu yang diberikan.\n\n"
+        f"Segera follow up ke Driver: {driver['phone_number']}\n\n"
+        f"Start pengantaran: {start_time_str}"
+    )
+    for admin_number in admin_numbers:
+        payloads.append({
+            "command": "send_message",
+            "number": BOT_NUMBER,
+            "number_recipient": admin_number,
+            "message": msg_admin
+        })
+    return payloads
+
+
+# Interval cek keterlambatan (detik) dan threshold default awal (menit,
+# disimpan ke tabel settings saat start pertama; setelah itu diubah lewat API)
+SYNC_INTERVAL_SECONDS = float(os.getenv("SYNC_INTERVAL_SECONDS", "30"))
+LATE_THRESHOLD_MINUTES = int(os.getenv("LATE_THRESHOLD_MINUTES", "45"))
+
+lateness_rules = LatenessRules(LATE_THRESHOLD_MINUTES)
+with pool.connection() as conn:
+    # Default awal disimpan di settings agar trigger riwayat trip (lihat
+    # db.py) memakai threshold yang sama dengan cek keterlambatan
+    conn.execute(
+        "INSERT OR IGNORE INTO settings (key, value) VALUES ('late_threshold_minutes', ?)",
+        (str(LATE_THRESHOLD_MINUTES),)
+    )
     conn.commit()
-    conn.close()
-    return {"message": "Status synchronized with WA payloads"}
-
-@app.get("/drivers/next_id")
-def get_next_driver_id():
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT MAX(id) FROM drivers")
-    last_id = cursor.fetchone()[0]
-    next_id = (last_id or 0) + 1
-    conn.close()
-    return {"next_id": next_id}
+    lateness_rules.reload(conn)
+
+
+def check_late_drivers() -> dict:
+    now = int(datetime.now().timestamp())
+    # Kandidat diambil dari driver_state (tanpa query) memakai threshold
+    # terkecil; threshold tiap driver diambil dari lateness_rules
+    cutoff = now - lateness_rules.min_minutes() * 60
+    candidates = driver_state.late_candidates(cutoff)
+    LATENESS_SCANNED.inc(len(candidates))
+    late = [
+        (row["id"], row["delivery_start_epoch"]) for row in candidates
+        if row["delivery_start_epoch"] + lateness_rules.minutes(row["id"]) * 60 <= now
+    ]
+    if not late:
+        return {"late_drivers": 0}
+
+    with get_db() as conn:
+        # Tandai sekaligus ambil driver yang terlambat. Kondisi di WHERE
+        # memastikan trip yang ditandai masih trip yang sama dengan salinan
+        # di memori, walau ada scan yang commit di antaranya.
+        with DB_QUERY_SECONDS.time(query="lateness_claim"):
+            late_drivers = conn.execute(f"""
+                UPDATE drivers SET late_notified = 1, row_version = row_version + 1
+                FROM (VALUES {", ".join(["(?, ?)"] * len(late))}) AS c
+                WHERE drivers.id = c.column1 AND drivers.delivery_start_epoch = c.column2
+                  AND drivers.status = 'JALAN' AND drivers.late_notified = 0
+                RETURNING {STATE_COLUMNS}
+            """, [value for pair in late for value in pair]).fetchall()
+        LATENESS_LATE.inc(len(late_drivers))
+        if not late_drivers:
+            conn.commit()
+            return {"late_drivers": 0}
+
+        # Ambil semua admin
+        admins = conn.execute("SELECT phone_number FROM admins").fetchall()
+        admin_numbers = [a["phone_number"] for a in admins]
+
+        payloads = []
+        for d in late_drivers:
+            logger.info("Driver terlambat: %s (id %s)", d["name"], d["id"])
+            payloads.extend(late_driver_payloads(d, admin_numbers))
+
+        # Pesan masuk outbox dalam transaksi yang sama dengan tanda
+        # late_notified; pengiriman ke RabbitMQ dilakukan alert_dispatcher
+        alert_outbox.add(conn, payloads)
+        conn.commit()
+
+    driver_state.apply(late_drivers)
+    alert_dispatcher.trigger()
+    return {"late_drivers": len(late_drivers), "alerts_queued": len(payloads)}
+
+
+ALERT_DISPATCH_INTERVAL_SECONDS = float(os.getenv("ALERT_DISPATCH_INTERVAL_SECONDS", "5"))
+ALERT_MAX_ATTEMPTS = int(os.getenv("ALERT_MAX_ATTEMPTS", "8"))
+
+alert_outbox = AlertOutbox(pool, alert_publisher, max_attempts=ALERT_MAX_ATTEMPTS, on_sent=log_message)
+lateness_task = PeriodicTask("lateness-check", SYNC_INTERVAL_SECONDS, check_late_drivers)
+alert_dispatcher = PeriodicTask("alert-dispatcher", ALERT_DISPATCH_INTERVAL_SECONDS, alert_outbox.dispatch)
+
+
+# Interval pemeriksaan driver_state terhadap database (detik)
+DRIVER_STATE_CHECK_SECONDS = float(os.getenv("DRIVER_STATE_CHECK_SECONDS", "300"))
+
+
+def check_driver_state(repair: bool = True) -> dict:
+    # Selisih hanya muncul jika database diubah di luar API (mis. lewat
+    # sqlite3 CLI) atau ada write-through yang terlewat
+    with get_db() as conn:
+        report = driver_state.check(conn, repair=repair)
+    drift = {kind: len(report[kind]) for kind in ("stale", "mismatched", "missing", "extra") if report[kind]}
+    for kind, n in drift.items():
+        STATE_DRIFT.inc(n, kind=kind)
+    if drift:
+        logger.warning("Driver state drift%s: %s", " repaired" if repair else "", drift)
+        if repair:
+            data_changed()
+    return report
+
+
+driver_state_task = PeriodicTask("driver-state-check", DRIVER_STATE_CHECK_SECONDS, check_driver_state)
+
+
+def rules_changed(conn: sqlite3.Connection):
+    """Dipanggil setelah commit oleh setiap endpoint yang mengubah threshold."""
+    lateness_rules.reload(conn)
+    broadcaster.publish({"type": "thresholds"})
+    # Aturan baru langsung berlaku tanpa menunggu interval berikutnya
+    lateness_task.trigger()
+
+
+def set_default_threshold(minutes: int):
+    if minutes < 1:
+        raise HTTPException(status_code=400, detail="threshold must be at least 1 minute")
+    with get_db() as conn:
+        conn.execute("""
+            INSERT INTO settings (key, value) VALUES ('late_threshold_minutes', ?)
+            ON CONFLICT (key) DO UPDATE SET value = excluded.value
+        """, (str(minutes),))
+        conn.commit()
+        rules_changed(conn)
+
+
+@app.post("/sync")
+def sync_status():
+    # Hanya memicu cek di background; tidak menunggu pengiriman WA.
+    # ?treshold_minutes= dari dashboard lama diabaikan: threshold default
+    # hanya diubah lewat PUT /thresholds/default.
+    lateness_task.trigger()
+    return {
+        "message": "Sync scheduled",
+        "treshold_minutes": lateness_rules.default_minutes,
+        **lateness_task.status()
+    }
+
+
+@app.get("/sync")
+def read_sync_status():
+    return {
+        "treshold_minutes": lateness_rules.default_minutes,
+        **lateness_task.status(),
+        "dispatcher": alert_dispatcher.status(),
+        "outbox": alert_outbox.stats()
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics():
+    # Format teks Prometheus (lihat metrics.py)
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/thresholds")
+def read_thresholds():
+    # default, zona, dan threshold hasil resolve untuk driver yang punya aturan
+    return lateness_rules.snapshot()
+
+
+@app.put("/thresholds/default")
+def update_default_threshold(minutes: int):
+    set_default_threshold(minutes)
+    return {"default_minutes": lateness_rules.default_minutes}
+
+
+@app.post("/zones", response_model=Zone)
+def create_zone(zone: Zone):
+    if zone.threshold_minutes is not None and zone.threshold_minutes < 1:
+        raise HTTPException(status_code=400, detail="threshold must be at least 1 minute")
+    with get_db() as conn:
+        try:
+            cursor = conn.execute(
+                "INSERT INTO zones (name, threshold_minutes) VALUES (?, ?)",
+                (zone.name, zone.threshold_minutes)
+            )
+        except sqlite3.IntegrityError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        conn.commit()
+        zone.id = cursor.lastrowid
+        rules_changed(conn)
+    return zone
+
+
+@app.put("/zones/{zone_id}")
+def update_zone(zone_id: int, zone: Zone):
+    if zone.threshold_minutes is not None and zone.threshold_minutes < 1:
+        raise HTTPException(status_code=400, detail="threshold must be at least 1 minute")
+    with get_db() as conn:
+        try:
+            cursor = conn.execute(
+                "UPDATE zones SET name = ?, threshold_minutes = ? WHERE id = ?",
+                (zone.name, zone.threshold_minutes, zone_id)
+            )
+        except sqlite3.IntegrityError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        if cursor.rowcount == 0:
+            raise HTTPException(status_code=404, detail="Zone not found")
+        conn.commit()
+        rules_changed(conn)
+    return {"message": "Zone updated"}
+
+
+@app.delete("/zones/{zone_id}")
+def delete_zone(zone_id: int):
+    with get_db() as conn:
+        # Driver di zona ini kembali memakai default
+        conn.execute("UPDATE drivers SET zone_id = NULL WHERE zone_id = ?", (zone_id,))
+        cursor = conn.execute("DELETE FROM zones WHERE id = ?", (zone_id,))
+        if cursor.rowcount == 0:
+            raise HTTPException(status_code=404, detail="Zone not found")
+        conn.commit()
+        rules_changed(conn)
+    return {"message": "Zone deleted"}
+
+
+@app.put("/drivers/{driver_id}/threshold")
+def update_driver_threshold(driver_id: int, rule: DriverThreshold):
+    if rule.late_threshold_minutes is not None and rule.late_threshold_minutes < 1:
+        raise HTTPException(status_code=400, detail="threshold must be at least 1 minute")
+    with get_db() as conn:
+        if rule.zone_id is not None and not conn.execute(
+            "SELECT 1 FROM zones WHERE id = ?", (rule.zone_id,)
+        ).fetchone():
+            raise HTTPException(status_code=404, detail="Zone not found")
+        cursor = conn.execute(
+            "UPDATE drivers SET zone_id = ?, late_threshold_minutes = ? WHERE id = ?",
+            (rule.zone_id, rule.late_threshold_minutes, driver_id)
+        )
+        if cursor.rowcount == 0:
+            raise HTTPException(status_code=404, detail="Driver not found")
+        conn.commit()
+        rules_changed(conn)
+    return {"driver_id": driver_id, "threshold_minutes": lateness_rules.minutes(driver_id)}
+
+
+@app.post("/alerts/retry")
+def retry_dead_alerts():
+    # Kirim ulang pesan yang sudah melewati batas percobaan (DEAD)
+    retried = alert_outbox.retry_dead()
+    alert_dispatcher.trigger()
+    return {"retried": retried}
+
+@app.post("/drivers/state/check")
+def run_driver_state_check(repair: bool = True):
+    # Bandingkan state driver di memori dengan database; repair=false hanya melapor
+    return check_driver_state(repair)
+
+
+@app.get("/drivers/changes")
+async def read_driver_changes(since: int = 0, limit: int = 500):
+    # Delta feed: hanya driver yang berubah setelah versi `since`, plus
+    # tombstone untuk driver yang dihapus. Client menyimpan `version` dari
+    # respons dan mengirimnya lagi sebagai `since` berikutnya.
+    limit = max(1, min(limit, 5000))
+    columns = ", ".join(f"d.{field}" for field in DRIVER_FIELDS)
+    async with get_async_db() as conn:
+        with DB_QUERY_SECONDS.time(query="driver_changes"):
+            rows = await conn.execute_fetchall(f"""
+                SELECT c.version, c.driver_id, c.deleted, {columns}
+                FROM driver_changes c LEFT JOIN drivers d ON d.id = c.driver_id
+                WHERE c.version > ?
+                ORDER BY c.version LIMIT ?
+            """, (since, limit + 1))
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    changes = []
+    for row in rows:
+        if row["deleted"]:
+            changes.append({"version": row["version"], "id": row["driver_id"], "deleted": True})
+        else:
+            changes.append({"version": row["version"], **{field: row[field] for field in DRIVER_FIELDS}})
+    return {
+        "version": rows[-1]["version"] if rows else since,
+        "has_more": has_more,
+        "changes": changes
+    }
+
+
+@app.websocket("/ws/status")
+async def status_stream(websocket: WebSocket):
+    # Stream perubahan status driver. Event "status" berisi baris driver
+    # terbaru; "changed"/"resync" berarti client perlu menarik
+    # /drivers/changes.
+    # Socket juga dibaca agar client yang menutup koneksi langsung
+    # di-unsubscribe, tanpa menunggu broadcast berikutnya gagal terkirim.
+    # Pesan dari client diabaikan.
+    await websocket.accept()
+    queue = broadcaster.subscribe()
+    receiving = asyncio.ensure_future(websocket.receive())
+    sending = None
+    try:
+        while True:
+            if sending is None:
+                sending = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({receiving, sending}, return_when=asyncio.FIRST_COMPLETED)
+            if sending in done:
+                await websocket.send_json(sending.result())
+                sending = None
+            if receiving in done:
+                if receiving.result()["type"] == "websocket.disconnect":
+                    break
+                receiving = asyncio.ensure_future(websocket.receive())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in (receiving, sending):
+            if task is not None:
+                task.cancel()
+        broadcaster.unsubscribe(queue)
+
+
+@app.get("/dashboard")
+async def read_dashboard():
+    # Semua yang dibutuhkan halaman Driver Status dalam satu respons:
+    # jumlah per status, daftar driver per kolom, dan waktu jalan yang
+    # sudah dihitung di server dengan threshold masing-masing driver.
+    # Dilayani dari driver_state tanpa query database.
+    now = int(datetime.now().timestamp())
+    counts = dict.fromkeys(STATUSES, 0)
+    columns = {status: [] for status in STATUSES}
+    for row in driver_state.select():
+        counts[row["status"]] += 1
+        driver = {"id": row["id"], "name": row["name"], "phone_number": row["phone_number"]}
+        if row["status"] == "JALAN" and row["delivery_start_epoch"] is not None:
+            elapsed = (now - row["delivery_start_epoch"]) / 60.0
+            threshold = lateness_rules.minutes(row["id"])
+            driver["elapsed_minutes"] = int(elapsed)
+            driver["threshold_minutes"] = threshold
+            driver["progress"] = round(min(elapsed / threshold, 1.0), 3)
+            driver["late"] = elapsed > threshold
+        columns[row["status"]].append(driver)
+
+    return {"treshold_minutes": lateness_rules.default_minutes, "counts": counts, "drivers": columns}
+
+
+@app.get("/trips")
+async def read_trips(
+    driver_id: Optional[int] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    after_id: int = 0,
+    limit: int = Query(500, ge=1, le=5000)
+):
+    # Riwayat trip mentah (keyset pada id); start/end = tanggal lokal selesai trip
+    conditions, params = ["t.id > ?"], [after_id]
+    if driver_id is not None:
+        conditions.append("t.driver_id = ?")
+        params.append(driver_id)
+    if start is not None:
+        conditions.append("t.end_epoch >= ?")
+        params.append(int(datetime.combine(start, time.min).timestamp()))
+    if end is not None:
+        conditions.append("t.end_epoch < ?")
+        params.append(int(datetime.combine(end + timedelta(days=1), time.min).timestamp()))
+    async with get_async_db() as conn:
+        rows = await conn.execute_fetchall(f"""
+            SELECT t.id, t.driver_id, d.name, t.start_epoch, t.end_epoch,
+                   t.duration_seconds, t.late, t.end_status
+            FROM trips t LEFT JOIN drivers d ON d.id = t.driver_id
+            WHERE {" AND ".join(conditions)}
+            ORDER BY t.id LIMIT ?
+        """, (*params, limit))
+
+    return [{
+        "id": row["id"],
+        "driver_id": row["driver_id"],
+        "name": row["name"],
+        "start": datetime.fromtimestamp(row["start_epoch"]).isoformat(),
+        "end": datetime.fromtimestamp(row["end_epoch"]).isoformat(),
+        "duration_minutes": round(row["duration_seconds"] / 60, 1),
+        "late": bool(row["late"]),
+        "end_status": row["end_status"]
+    } for row in rows]
+
+
+def day_range(start: Optional[date], end: Optional[date]) -> tuple:
+    # Default: 7 hari terakhir termasuk hari ini
+    end = end or date.today()
+    start = start or end - timedelta(days=6)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    return start.isoformat(), end.isoformat()
+
+
+def trip_summary(row) -> dict:
+    trips = row["trips"]
+    return {
+        "trips": trips,
+        "late_trips": row["late_trips"],
+        "avg_minutes": round(row["total_seconds"] / trips / 60, 1) if trips else None,
+        "max_minutes": round(row["max_seconds"] / 60, 1) if trips else None
+    }
+
+
+@app.get("/analytics/drivers")
+async def read_driver_analytics(start: Optional[date] = None, end: Optional[date] = None):
+    # Rekap per driver dari trip_daily (bukan dari riwayat trip)
+    day_from, day_to = day_range(start, end)
+    async with get_async_db() as conn:
+        rows = await conn.execute_fetchall("""
+            SELECT r.driver_id, d.name, SUM(r.trips) AS trips, SUM(r.late_trips) AS late_trips,
+                   SUM(r.total_seconds) AS total_seconds, MAX(r.max_seconds) AS max_seconds
+            FROM trip_daily r LEFT JOIN drivers d ON d.id = r.driver_id
+            WHERE r.day BETWEEN ? AND ?
+            GROUP BY r.driver_id ORDER BY r.driver_id
+        """, (day_from, day_to))
+
+    return {
+        "start": day_from,
+        "end": day_to,
+        "drivers": [{"driver_id": row["driver_id"], "name": row["name"], **trip_summary(row)} for row in rows]
+    }
+
+
+@app.get("/analytics/daily")
+async def read_daily_analytics(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    driver_id: Optional[int] = None
+):
+    # Rekap per hari (semua driver, atau satu driver dengan driver_id)
+    day_from, day_to = day_range(start, end)
+    sql = """
+        SELECT day, SUM(trips) AS trips, SUM(late_trips) AS late_trips,
+               SUM(total_seconds) AS total_seconds, MAX(max_seconds) AS max_seconds
+        FROM trip_daily WHERE day BETWEEN ? AND ?
+    """
+    params = [day_from, day_to]
+    if driver_id is not None:
+        sql += " AND driver_id = ?"
+        params.append(driver_id)
+    sql += " GROUP BY day ORDER BY day"
+    async with get_async_db() as conn:
+        rows = await conn.execute_fetchall(sql, params)
+
+    return {
+        "start": day_from,
+        "end": day_to,
+        "days": [{"day": row["day"], **trip_summary(row)} for row in rows]
+    }
+
+
+# Batas waktu satu long-poll (detik); client mengulang sampai timeout-nya sendiri
+LONG_POLL_MAX_SECONDS = 30
+
+# Perintah enroll/delete ke ESP32 dan hasilnya lewat satu koneksi MQTT milik
+# backend (lihat mqtt_bridge.py). POST /enroll/status dan /delete/status
+# tetap ada untuk firmware lama yang melapor lewat HTTP.
+MQTT_ENABLED = os.getenv("MQTT_ENABLED", "1") == "1"
+MQTT_HOST = os.getenv("MQTT_HOST", "localhost")
+MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
+MQTT_USER = os.getenv("MQTT_USER", "guest")
+MQTT_PASS = os.getenv("MQTT_PASS", "guest")
+
+ENROLL_TOPIC = "fingerprint/enroll"
+ENROLL_RESPONSE = "fingerprint/enroll/response"
+DELETE_TOPIC = "fingerprint/delete"
+DELETE_RESPONSE = "fingerprint/delete/response"
+
+mqtt_bridge = MqttBridge(MQTT_HOST, MQTT_PORT, MQTT_USER, MQTT_PASS)
+
+
+def on_enroll_response(payload: dict):
+    result = EnrollmentStatus(**payload)
+    enroll_results.resolve(result.id, result.dict())
+
+
+def on_delete_response(payload: dict):
+    result = DeletionStatus(**payload)
+    delete_results.resolve(result.id, result.dict())
+
+
+mqtt_bridge.subscribe(ENROLL_RESPONSE, on_enroll_response)
+mqtt_bridge.subscribe(DELETE_RESPONSE, on_delete_response)
+
+# Jalur scan alternatif lewat MQTT (endpoint HTTP scan tetap ada). Device
+# publish ke SCAN_TOPIC: {"device": "...", "fingerprint_id": 3, "off": false,
+# "ts": <detik unix, opsional>, "seq": <bebas, dikembalikan di hasil>,
+# "idempotency_key": <opsional, sama untuk pengiriman ulang>};
+# hasil dikirim ke fingerprint/scan/result/<device>.
+SCAN_TOPIC = "fingerprint/scan"
+SCAN_RESULT_TOPIC = "fingerprint/scan/result/{device}"
+SCAN_BATCH_WINDOW_SECONDS = float(os.getenv("SCAN_BATCH_WINDOW_SECONDS", "0.05"))
+
+
+def publish_scan_result(event: dict, result: Optional[dict], duplicate: bool = False):
+    if result is None:
+        result = {"error": "Scan failed, please retry"}
+    elif duplicate:
+        result = {**result, "duplicate": True}
+    if event.get("device"):
+        mqtt_bridge.publish(
+            SCAN_RESULT_TOPIC.format(device=event["device"]),
+            {**result, "fingerprint_id": event["fingerprint_id"], "seq": event.get("seq")}
+        )
+
+
+def on_scan_message(payload: dict):
+    # Duplikat dijawab dari scan_dedup sebelum masuk antrean batcher;
+    # scan yang sama dengan scan yang masih di antrean ikut hasilnya
+    event = dict(payload, fingerprint_id=int(payload["fingerprint_id"]))
+    fingerprint_id, off = event["fingerprint_id"], bool(event.get("off"))
+    known = driver_state.by_fingerprint(fingerprint_id)
+    if known is None:
+        if event.get("device"):
+            mqtt_bridge.publish(SCAN_RESULT_TOPIC.format(device=event["device"]), {
+                "error": "Driver not found", "fingerprint_id": fingerprint_id, "seq": event.get("seq")
+            })
+        return
+    state, previous = scan_dedup.begin(
+        fingerprint_id, off, known["row_version"],
+        lambda result: publish_scan_result(event, result, duplicate=True), event.get("idempotency_key")
+    )
+    if state == DUPLICATE:
+        SCAN_DUPLICATES.inc(path="mqtt", kind="repeat")
+        publish_scan_result(event, previous, duplicate=True)
+    elif state == JOINED:
+        SCAN_DUPLICATES.inc(path="mqtt", kind="inflight")
+    else:
+        # Dibawa event sampai on_scan_result; tidak ikut dipublish
+        event["dedup_scan"] = previous
+        scan_batcher.submit(event)
+
+
+def on_scan_result(event: dict, driver):
+    result = None
+    if driver is not None and not isinstance(driver, Exception):
+        driver_state.apply([driver])
+        data_changed(status_event(driver))
+        result = scan_result(driver)
+    scan_dedup.finish(event["dedup_scan"], result, driver["row_version"] if result else None)
+    publish_scan_result(event, {"error": "Driver not found"} if driver is None else result)
+
+
+scan_batcher = ScanBatcher(pool, on_scan_result, window=SCAN_BATCH_WINDOW_SECONDS)
+mqtt_bridge.subscribe(SCAN_TOPIC, on_scan_message)
+
+
+def send_device_command(topic: str, command: str, fingerprint_id: int):
+    if not mqtt_bridge.publish(topic, {"command": command, "id": fingerprint_id}):
+        raise HTTPException(status_code=503, detail="MQTT broker not connected")
+
+
+@app.post("/enroll/{fingerprint_id}/start")
+def start_enroll(fingerprint_id: int):
+    # id biasanya sudah direservasi lewat POST /drivers/next_id
+    enroll_results.start(fingerprint_id)
+    send_device_command(ENROLL_TOPIC, "enroll", fingerprint_id)
+    return {"pending": True}
+
+
+@app.post("/delete/{fingerprint_id}/start")
+def start_delete_command(fingerprint_id: int):
+    # Buang hasil lama lalu kirim perintah delete ke ESP32
+    delete_results.start(fingerprint_id)
+    send_device_command(DELETE_TOPIC, "delete", fingerprint_id)
+    return {"pending": True}
+
+
 
 @app.post("/enroll/status")
 def receive_enroll_status(payload: EnrollmentStatus):
-    # Kirim data ke queue agar Streamlit bisa ambil
-    enroll_status_queue.put(payload.dict())
+    # Bangunkan client yang menunggu hasil untuk fingerprint id ini
+    enroll_results.resolve(payload.id, payload.dict())
     return {"received": True}
 
 @app.get("/enroll/status/poll")
-def poll_enroll_status():
-    if not enroll_status_queue.empty():
-        return enroll_status_queue.get()
-    return {}  # kosong jika belum ada
+def poll_enroll_status(fingerprint_id: Optional[int] = None):
+    # Tanpa fingerprint_id: hasil tertua (kompatibilitas client lama)
+    return enroll_results.pop(fingerprint_id) or {}  # kosong jika belum ada
+
+@app.get("/enroll/status/wait/{fingerprint_id}")
+async def wait_enroll_status(fingerprint_id: int, timeout: float = 25):
+    # Long-poll: respons dikirim begitu ESP32 melapor, atau {} saat timeout
+    result = await enroll_results.wait(fingerprint_id, min(timeout, LONG_POLL_MAX_SECONDS))
+    return result or {}
 
 @app.post("/delete/status")
 def receive_delete_status(payload: DeletionStatus):
-    # Kirim data ke queue agar Streamlit bisa ambil
-    delete_status_queue.put(payload.dict())
+    delete_results.resolve(payload.id, payload.dict())
     return {"received": True}
 
 @app.get("/delete/status/poll")
-def poll_delete_status():
-    if not delete_status_queue.empty():
-        return delete_status_queue.get()
-    return {}  # kosong jika belum ada
+def poll_delete_status(fingerprint_id: Optional[int] = None):
+    return delete_results.pop(fingerprint_id) or {}  # kosong jika belum ada
+
+@app.get("/delete/status/wait/{fingerprint_id}")
+async def wait_delete_status(fingerprint_id: int, timeout: float = 25):
+    result = await delete_results.wait(fingerprint_id, min(timeout, LONG_POLL_MAX_SECONDS))
+    return result or {}
+
+@app.get("/drivers/{driver_id}", response_model=Driver)
+async def read_driver(driver_id: int):
+    driver = driver_state.get(driver_id)
+    if driver is None:
+        raise HTTPException(status_code=404, detail="Driver not found")
+    return {field: driver[field] for field in DRIVER_FIELDS}
 
 if __name__ == "__main__":
     import uvicorn
+    # Wajib satu worker (default di sini dan di `uvicorn main:app`): registry
+    # operasi enroll/delete, reservasi id, driver_state, lateness_rules,
+    # scan_dedup, cache respons dan subscriber WebSocket hanya ada di memori
+    # proses ini, jadi hasil dari ESP32, long-poll client dan setiap tulis
+    # harus sampai di proses yang sama.
     uvicorn.run(app, host="0.0.0.0", port=8080)
@@ -0,0 +1,90 @@
+import json
+import logging
+import threading
+
+import paho.mqtt.client as mqtt
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+RECEIVED = metrics.counter("mqtt_messages_received_total", "Pesan MQTT yang diterima bridge", ("topic",))
+PUBLISHED = metrics.counter("mqtt_messages_published_total", "Pesan MQTT yang dikirim bridge", ("topic",))
+
+
+class MqttBridge:
+    """Satu koneksi MQTT milik backend untuk komunikasi dengan ESP32.
+
+    Handler didaftarkan per topic lewat `subscribe()` dan dipanggil di
+    thread network paho dengan payload JSON yang sudah di-decode. Topic
+    di-subscribe ulang setiap kali koneksi tersambung, dan paho mencoba
+    menyambung ulang sendiri, jadi broker yang mati tidak menghentikan
+    backend. `publish()` mengirim perintah ke ESP32 lewat koneksi yang sama.
+
+    `client_factory` bisa diganti untuk pengujian tanpa broker.
+    """
+
+    def __init__(self, host: str, port: int = 1883, user: str = None, password: str = None,
+                 client_id: str = "kulkasbabeh-backend", client_factory=None):
+        self.host = host
+        self.port = port
+        self._handlers = {}
+        self._connected = threading.Event()
+        factory = client_factory or (lambda: mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id))
+        self.client = factory()
+        if user:
+            self.client.username_pw_set(user, password)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_message = self._on_message
+
+    def subscribe(self, topic: str, handler, qos: int = 1):
+        self._handlers[topic] = (handler, qos)
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    def start(self):
+        # Non-blocking: koneksi (dan retry-nya) berjalan di thread paho
+        self.client.connect_async(self.host, self.port, keepalive=60)
+        self.client.loop_start()
+
+    def stop(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+        self._connected.clear()
+
+    def publish(self, topic: str, payload: dict, qos: int = 1) -> bool:
+        """Return False jika belum tersambung ke broker."""
+        if not self.connected:
+            return False
+        info = self.client.publish(topic, json.dumps(payload), qos=qos)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            return False
+        PUBLISHED.inc(topic=topic)
+        return True
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties=None):
+        if reason_code.is_failure:
+            logger.warning("MQTT connect to %s:%s failed: %s", self.host, self.port, reason_code)
+            return
+        self._connected.set()
+        logger.info("MQTT connected to %s:%s", self.host, self.port)
+        if self._handlers:
+            client.subscribe([(topic, qos) for topic, (_, qos) in self._handlers.items()])
+
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties=None):
+        self._connected.clear()
+        logger.warning("MQTT disconnected: %s", reason_code)
+
+    def _on_message(self, client, userdata, message):
+        RECEIVED.inc(topic=message.topic)
+        entry = self._handlers.get(message.topic)
+        if entry is None:
+            return
+        try:
+            entry[0](json.loads(message.payload))
+        except Exception:
+            # Pesan rusak dari satu device tidak boleh menghentikan loop paho
+            logger.exception("Invalid MQTT message on %s", message.topic)
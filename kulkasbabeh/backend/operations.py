@@ -0,0 +1,114 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+
+class OperationRegistry:
+    """Operasi ESP32 (enroll/delete) yang sedang berjalan, dikunci per id.
+
+    Setiap entri berisi status operasi (pending atau sudah ada hasil) dan
+    kedaluwarsa setelah `ttl` detik. Jumlah entri dibatasi `max_entries`;
+    entri tertua dibuang lebih dulu. `resolve()` dipanggil saat ESP32
+    mengirim hasil dan langsung membangunkan client yang sedang `wait()`.
+    """
+
+    def __init__(self, ttl: float = 120.0, max_entries: int = 1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # key -> (expires_at, result atau None jika masih pending)
+        self._entries = OrderedDict()
+        self._waiters = {}
+        self._lock = threading.Lock()
+
+    def _evict(self, now: float):
+        # Entri selalu disisipkan di akhir dengan TTL yang sama, jadi urutan
+        # OrderedDict juga urutan kedaluwarsa
+        while self._entries:
+            expires_at, _ = next(iter(self._entries.values()))
+            if expires_at > now:
+                break
+            self._entries.popitem(last=False)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _put(self, key, result):
+        now = time.monotonic()
+        self._entries.pop(key, None)
+        self._entries[key] = (now + self.ttl, result)
+        self._evict(now)
+
+    def start(self, key):
+        """Tandai operasi `key` sedang berjalan dan buang hasil lama."""
+        with self._lock:
+            self._put(key, None)
+
+    def pending_keys(self) -> set:
+        with self._lock:
+            self._evict(time.monotonic())
+            return {key for key, (_, result) in self._entries.items() if result is None}
+
+    def resolve(self, key, result: dict):
+        """Simpan hasil untuk `key`. Aman dipanggil dari thread mana pun."""
+        with self._lock:
+            waiters = self._waiters.pop(key, [])
+            if waiters:
+                self._entries.pop(key, None)
+            else:
+                self._put(key, result)
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_set_result, future, result)
+
+    def discard(self, key):
+        """Hapus entri `key` tanpa membangunkan waiter (mis. reservasi yang sudah dipakai)."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def pop(self, key=None):
+        """Ambil hasil untuk `key` (atau hasil tertua jika None) tanpa menunggu."""
+        with self._lock:
+            self._evict(time.monotonic())
+            if key is None:
+                key = next((k for k, (_, result) in self._entries.items() if result is not None), None)
+            entry = self._entries.get(key)
+            if entry is None or entry[1] is None:
+                return None
+            del self._entries[key]
+            return entry[1]
+
+    async def wait(self, key, timeout: float):
+        """Tunggu hasil untuk `key`, return None jika timeout."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._evict(time.monotonic())
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is not None:
+                del self._entries[key]
+                return entry[1]
+            future = loop.create_future()
+            self._waiters.setdefault(key, []).append((loop, future))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(key, [])
+                if (loop, future) in waiters:
+                    waiters.remove((loop, future))
+                    if not waiters:
+                        del self._waiters[key]
+
+    def __len__(self):
+        with self._lock:
+            self._evict(time.monotonic())
+            return len(self._entries)
+
+    def waiting(self) -> int:
+        with self._lock:
+            return sum(len(waiters) for waiters in self._waiters.values())
+
+
+def _set_result(future, result):
+    if not future.done():
+        future.set_result(result)
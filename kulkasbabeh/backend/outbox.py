@@ -0,0 +1,96 @@
+import json
+import time
+
+
+class AlertOutbox:
+    """Transactional outbox untuk pesan WhatsApp di tabel alert_outbox.
+
+    Pesan ditulis dengan `add()` di transaksi yang sama dengan perubahan
+    data yang memicunya, lalu dikirim ke RabbitMQ oleh `dispatch()` yang
+    dijalankan di background. Pengiriman yang gagal dicoba lagi dengan
+    exponential backoff; setelah `max_attempts` pesan ditandai DEAD dan
+    tidak dikirim lagi sampai di-retry manual.
+    """
+
+    def __init__(self, pool, publisher, batch_size: int = 100, max_attempts: int = 8,
+                 base_backoff: float = 5.0, max_backoff: float = 600.0, on_sent=None):
+        self.pool = pool
+        self.publisher = publisher
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.on_sent = on_sent
+
+    def add(self, conn, payloads: list):
+        """Tambahkan pesan ke outbox. Tidak melakukan commit."""
+        now = time.time()
+        conn.executemany(
+            "INSERT INTO alert_outbox (payload, next_attempt_epoch, created_epoch) VALUES (?, ?, ?)",
+            [(json.dumps(payload), now, now) for payload in payloads],
+        )
+
+    def backoff(self, attempts: int) -> float:
+        return min(self.base_backoff * 2 ** (attempts - 1), self.max_backoff)
+
+    def dispatch(self) -> dict:
+        """Kirim semua pesan PENDING yang sudah jatuh tempo."""
+        sent = failed = dead = 0
+        while True:
+            with self.pool.connection() as conn:
+                rows = conn.execute("""
+                    SELECT id, payload, attempts FROM alert_outbox
+                    WHERE status = 'PENDING' AND next_attempt_epoch <= ?
+                    ORDER BY id LIMIT ?
+                """, (time.time(), self.batch_size)).fetchall()
+            if not rows:
+                break
+
+            # Koneksi database tidak ditahan selama menunggu broker
+            payloads = [json.loads(row["payload"]) for row in rows]
+            try:
+                self.publisher.publish_batch(payloads)
+            except Exception as e:
+                now = time.time()
+                updates = []
+                for row in rows:
+                    attempts = row["attempts"] + 1
+                    status = "DEAD" if attempts >= self.max_attempts else "PENDING"
+                    dead += status == "DEAD"
+                    updates.append((status, attempts, now + self.backoff(attempts), str(e), row["id"]))
+                with self.pool.connection() as conn:
+                    conn.executemany("""
+                        UPDATE alert_outbox
+                        SET status = ?, attempts = ?, next_attempt_epoch = ?, last_error = ?
+                        WHERE id = ?
+                    """, updates)
+                    conn.commit()
+                failed += len(rows)
+                break
+
+            with self.pool.connection() as conn:
+                conn.executemany("DELETE FROM alert_outbox WHERE id = ?", [(row["id"],) for row in rows])
+                conn.commit()
+            sent += len(rows)
+            if self.on_sent is not None:
+                for payload in payloads:
+                    self.on_sent(payload)
+
+        return {"sent": sent, "failed": failed, "dead": dead}
+
+    def stats(self) -> dict:
+        with self.pool.connection() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM alert_outbox GROUP BY status").fetchall()
+        counts = {"PENDING": 0, "DEAD": 0}
+        counts.update({row["status"]: row["n"] for row in rows})
+        return counts
+
+    def retry_dead(self) -> int:
+        """Kembalikan semua pesan DEAD ke antrean pengiriman."""
+        with self.pool.connection() as conn:
+            cursor = conn.execute("""
+                UPDATE alert_outbox SET status = 'PENDING', attempts = 0, next_attempt_epoch = ?
+                WHERE status = 'DEAD'
+            """, (time.time(),))
+            conn.commit()
+            return cursor.rowcount
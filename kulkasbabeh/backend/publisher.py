@@ -0,0 +1,102 @@
+import json
+import threading
+import time
+
+import pika
+from pika.exceptions import AMQPError
+
+import metrics
+
+PUBLISH_SECONDS = metrics.histogram(
+    "rabbitmq_publish_seconds", "Durasi publish satu batch sampai tx_commit, termasuk retry", ("outcome",)
+)
+PUBLISHED = metrics.counter("rabbitmq_messages_published_total", "Pesan yang sudah di-commit ke RabbitMQ")
+
+
+class AlertPublisher:
+    """Publisher RabbitMQ yang koneksi dan channel-nya dipakai ulang.
+
+    Koneksi dibuka sekali (lazy) lalu dipertahankan. Channel dijalankan
+    dalam mode transaksi (tx_select): satu batch payload dipublish lalu
+    dikonfirmasi broker dengan satu tx_commit, jadi fan-out ke banyak
+    admin hanya butuh satu round-trip konfirmasi. Jika koneksi putus,
+    publisher membuka koneksi baru dan mengulang batch sekali.
+
+    `connection_factory` bisa diganti (mis. FakeBroker di fake_broker.py)
+    agar publisher dapat diuji tanpa RabbitMQ.
+    """
+
+    def __init__(self, connection_factory, queue_name: str, retries: int = 1):
+        self.connection_factory = connection_factory
+        self.queue_name = queue_name
+        self.retries = retries
+        self._connection = None
+        self._channel = None
+        # BlockingConnection pika tidak thread-safe
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_params(cls, host: str, port: int, user: str, password: str, queue_name: str, **kwargs):
+        parameters = pika.ConnectionParameters(
+            host=host,
+            port=port,
+            credentials=pika.PlainCredentials(user, password),
+            heartbeat=60,
+        )
+        return cls(lambda: pika.BlockingConnection(parameters), queue_name, **kwargs)
+
+    def _ensure_channel(self):
+        if self._channel is not None and self._channel.is_open:
+            return self._channel
+        if self._connection is None or not self._connection.is_open:
+            self._connection = self.connection_factory()
+        channel = self._connection.channel()
+        channel.queue_declare(queue=self.queue_name, durable=True)
+        channel.tx_select()
+        self._channel = channel
+        return channel
+
+    def _reset(self):
+        try:
+            if self._connection is not None and self._connection.is_open:
+                self._connection.close()
+        except AMQPError:
+            pass
+        self._connection = None
+        self._channel = None
+
+    def publish_batch(self, payloads: list) -> int:
+        """Publish semua payload lalu commit sekali. Return jumlah pesan."""
+        if not payloads:
+            return 0
+        bodies = [json.dumps(payload) for payload in payloads]
+        properties = pika.BasicProperties(delivery_mode=2)  # persistent
+
+        with self._lock:
+            started = time.perf_counter()
+            for attempt in range(self.retries + 1):
+                try:
+                    channel = self._ensure_channel()
+                    for body in bodies:
+                        channel.basic_publish(
+                            exchange='',
+                            routing_key=self.queue_name,
+                            body=body,
+                            properties=properties,
+                        )
+                    channel.tx_commit()
+                    PUBLISH_SECONDS.observe(time.perf_counter() - started, outcome="ok")
+                    PUBLISHED.inc(len(bodies))
+                    return len(bodies)
+                except AMQPError:
+                    self._reset()
+                    if attempt == self.retries:
+                        PUBLISH_SECONDS.observe(time.perf_counter() - started, outcome="error")
+                        raise
+
+    def publish(self, payload: dict):
+        self.publish_batch([payload])
+
+    def close(self):
+        with self._lock:
+            self._reset()
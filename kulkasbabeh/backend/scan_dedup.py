@@ -0,0 +1,122 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Hasil ScanDedup.begin()
+NEW = "new"            # scan baru: jalankan lalu panggil finish(scan)
+DUPLICATE = "duplicate"  # hasil sebelumnya dikembalikan
+JOINED = "joined"      # scan yang sama sedang berjalan; waiter dipanggil saat selesai
+
+
+class InFlightScan:
+    """Scan NEW yang belum selesai; dikembalikan begin() dan diserahkan ke finish()."""
+
+    __slots__ = ("fingerprint_id", "off", "key", "waiters")
+
+    def __init__(self, fingerprint_id: int, off: bool, key: str = None):
+        self.fingerprint_id = fingerprint_id
+        self.off = off
+        self.key = key
+        self.waiters = []
+
+
+class ScanDedup:
+    """Buang scan fingerprint duplikat tanpa menyentuh database.
+
+    Dua jenis entri, masing-masing di OrderedDict dengan TTL sendiri:
+    - debounce: jari yang ditempel dua kali dalam `window` detik. Hasil
+      scan sebelumnya dipakai ulang hanya jika jenis scan sama (toggle/OFF)
+      dan `row_version` driver belum berubah sejak scan itu, jadi
+      perubahan lewat jalur lain (PUT, bulk, scan OFF) tidak tertutupi.
+    - idempotency key dari device: retry request yang sama (mis. setelah
+      timeout HTTP) selama `key_ttl` detik selalu mendapat hasil aslinya.
+
+    Scan yang datang saat scan yang sama (fingerprint + jenis) masih
+    berjalan tidak ikut menulis, dengan aturan yang sama: digabung jika
+    `window` > 0 atau idempotency key-nya sama. Waiter-nya dipanggil dengan
+    hasil scan pertama. Dengan `window` 0 dan key berbeda / tanpa key,
+    setiap scan tetap ditulis. Jumlah entri dibatasi `max_entries` per
+    jenis; entri tertua dibuang lebih dulu.
+    """
+
+    def __init__(self, window: float = 2.0, key_ttl: float = 60.0, max_entries: int = 1000):
+        self.window = window
+        self.key_ttl = key_ttl
+        self.max_entries = max_entries
+        # fingerprint_id -> (expires_at, off, row_version, result)
+        self._recent = OrderedDict()
+        # (fingerprint_id, key) -> (expires_at, result)
+        self._keys = OrderedDict()
+        # (fingerprint_id, off) -> [InFlightScan]
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._recent) + len(self._keys)
+
+    def _evict(self, entries: OrderedDict, now: float):
+        # TTL sama untuk semua entri satu jenis, jadi urutan sisip = urutan kedaluwarsa
+        while entries and next(iter(entries.values()))[0] <= now:
+            entries.popitem(last=False)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    def _previous(self, fingerprint_id: int, off: bool, row_version, key, now: float):
+        if key:
+            self._evict(self._keys, now)
+            entry = self._keys.get((fingerprint_id, key))
+            if entry is not None:
+                return entry[1]
+        self._evict(self._recent, now)
+        entry = self._recent.get(fingerprint_id)
+        if entry is not None and entry[1] == off and entry[2] == row_version:
+            return entry[3]
+        return None
+
+    def begin(self, fingerprint_id: int, off: bool, row_version, waiter, key: str = None) -> tuple:
+        """Return (NEW, InFlightScan), (DUPLICATE, hasil) atau (JOINED, None).
+
+        `row_version`: versi driver saat ini menurut driver_state. Untuk
+        JOINED, `waiter(hasil)` dipanggil dari finish(); hasil None berarti
+        scan pertama gagal. Setiap NEW wajib diakhiri finish(scan).
+        """
+        with self._lock:
+            previous = self._previous(fingerprint_id, off, row_version, key, time.monotonic())
+            if previous is not None:
+                return DUPLICATE, previous
+            running = self._inflight.setdefault((fingerprint_id, off), [])
+            for scan in running:
+                if self.window > 0 or (key and scan.key == key):
+                    scan.waiters.append(waiter)
+                    return JOINED, None
+            scan = InFlightScan(fingerprint_id, off, key)
+            running.append(scan)
+            return NEW, scan
+
+    def finish(self, scan: InFlightScan, result: dict = None, row_version: int = None):
+        """Akhiri scan NEW. `result` None jika gagal / driver tidak ditemukan (tidak disimpan)."""
+        fingerprint_id, key = scan.fingerprint_id, scan.key
+        now = time.monotonic()
+        with self._lock:
+            running = self._inflight.get((fingerprint_id, scan.off), [])
+            if scan in running:
+                running.remove(scan)
+                if not running:
+                    del self._inflight[(fingerprint_id, scan.off)]
+            if result is not None:
+                if self.window > 0:
+                    self._recent.pop(fingerprint_id, None)
+                    self._recent[fingerprint_id] = (now + self.window, scan.off, row_version, result)
+                    self._evict(self._recent, now)
+                if key:
+                    self._keys.pop((fingerprint_id, key), None)
+                    self._keys[(fingerprint_id, key)] = (now + self.key_ttl, result)
+                    self._evict(self._keys, now)
+        for waiter in scan.waiters:
+            try:
+                waiter(result)
+            except Exception:
+                logger.exception("Duplicate scan waiter failed")
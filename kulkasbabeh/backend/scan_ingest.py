@@ -0,0 +1,139 @@
+import logging
+import math
+import queue
+import threading
+import time
+from datetime import datetime
+
+import metrics
+from db import SCAN_OFF_SQL, SCAN_TOGGLE_SQL, ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = metrics.histogram(
+    "scan_batch_size", "Jumlah scan MQTT per transaksi", buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500)
+)
+BATCH_SECONDS = metrics.histogram("scan_batch_seconds", "Durasi transaksi satu batch scan MQTT")
+SCAN_EVENTS = metrics.counter("scan_events_total", "Scan yang diterima lewat MQTT", ("outcome",))
+
+
+class ScanBatcher:
+    """Terapkan scan fingerprint dari MQTT secara batch.
+
+    Event dikumpulkan selama `window` detik sejak event pertama (atau
+    sampai `max_batch`), diurutkan menurut timestamp event, lalu
+    diterapkan dengan statement yang sama seperti endpoint HTTP
+    (SCAN_TOGGLE_SQL / SCAN_OFF_SQL) dalam satu transaksi. Saat ramai,
+    biaya commit dibagi ke banyak scan; urutan scan untuk satu
+    fingerprint_id tetap terjaga.
+
+    `on_result(event, driver)` dipanggil per event setelah commit; `driver`
+    berisi baris RETURNING, None jika fingerprint tidak terdaftar, atau
+    exception jika transaksi gagal.
+    """
+
+    def __init__(self, pool: ConnectionPool, on_result, window: float = 0.05, max_batch: int = 200):
+        self.pool = pool
+        self.on_result = on_result
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def submit(self, event: dict):
+        """Antrekan satu scan. Aman dipanggil dari thread mana pun (mis. thread paho).
+
+        event: {"fingerprint_id": int, "off": bool (opsional), "ts": detik unix
+        (opsional, untuk urutan), "device": str, "seq": nilai bebas}
+        """
+        event = dict(event)
+        event["fingerprint_id"] = int(event["fingerprint_id"])
+        event["received"] = time.time()
+        event["ts"] = _timestamp(event.get("ts"))
+        self._queue.put(event)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="scan-batcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                event = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if event is None:
+                # Selesaikan batch ini dulu, lalu berhenti
+                self._queue.put(None)
+                break
+            batch.append(event)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            try:
+                results = self.apply(batch)
+            except Exception as e:
+                # Batch yang rusak tidak boleh menghentikan thread ini
+                logger.exception("Scan batch of %d failed", len(batch))
+                results = [(event, e) for event in batch]
+            for event, result in results:
+                try:
+                    self.on_result(event, result)
+                except Exception:
+                    logger.exception("Scan result callback failed")
+
+    def apply(self, batch: list) -> list:
+        """Terapkan satu batch dalam satu transaksi. Return [(event, driver/None/exception)]."""
+        BATCH_SIZE.observe(len(batch))
+        try:
+            # sort stabil: event dengan timestamp sama tetap urut kedatangan
+            batch = sorted(batch, key=lambda e: e.get("ts") or e["received"])
+            with BATCH_SECONDS.time(), self.pool.connection() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                results = []
+                for event in batch:
+                    if event.get("off"):
+                        rows = conn.execute(SCAN_OFF_SQL, (event["fingerprint_id"],)).fetchall()
+                    else:
+                        # delivery_start memakai jam server saat event diterima
+                        start = datetime.fromtimestamp(event["received"])
+                        rows = conn.execute(
+                            SCAN_TOGGLE_SQL, (start.isoformat(), int(start.timestamp()), event["fingerprint_id"])
+                        ).fetchall()
+                    results.append((event, rows[0] if rows else None))
+                conn.commit()
+        except Exception as e:
+            logger.exception("Scan batch of %d failed", len(batch))
+            SCAN_EVENTS.inc(len(batch), outcome="error")
+            return [(event, e) for event in batch]
+
+        for _, driver in results:
+            SCAN_EVENTS.inc(outcome="ok" if driver is not None else "not_found")
+        return results
+
+
+def _timestamp(value):
+    """`ts` dari device sebagai float; nilai yang tidak valid dibuang (None)."""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import threading
+import time
+from datetime import datetime
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+TASK_SECONDS = metrics.histogram("periodic_task_seconds", "Durasi satu eksekusi task background", ("task",))
+TASK_FAILURES = metrics.counter("periodic_task_failures_total", "Eksekusi task background yang gagal", ("task",))
+
+
+class PeriodicTask:
+    """Jalankan fungsi sinkron secara berkala di background event loop.
+
+    Fungsi dijalankan di thread terpisah (asyncio.to_thread) agar I/O
+    database tidak memblokir event loop. Guard single-flight memastikan
+    tidak ada dua eksekusi yang tumpang tindih, baik dari timer maupun
+    dari trigger manual.
+    """
+
+    def __init__(self, name: str, interval: float, func):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self._running = threading.Lock()
+        self._wakeup = None
+        self._loop_ref = None
+        self._task = None
+        self.runs = 0
+        self.last_run = None
+        self.last_duration = None
+        self.last_result = None
+        self.last_error = None
+
+    def run_once(self) -> bool:
+        """Jalankan sekali. Return False jika eksekusi lain masih berjalan."""
+        if not self._running.acquire(blocking=False):
+            return False
+        started = time.perf_counter()
+        try:
+            self.last_result = self.func()
+            self.last_error = None
+        except Exception as e:
+            self.last_error = str(e)
+            TASK_FAILURES.inc(task=self.name)
+            logger.exception("%s failed", self.name)
+        finally:
+            self.last_duration = time.perf_counter() - started
+            TASK_SECONDS.observe(self.last_duration, task=self.name)
+            self.last_run = datetime.now().isoformat()
+            self.runs += 1
+            self._running.release()
+        return True
+
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await asyncio.to_thread(self.run_once)
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._loop_ref = asyncio.get_running_loop()
+        self._task = asyncio.create_task(self._loop(), name=self.name)
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def trigger(self):
+        """Minta eksekusi segera tanpa menunggu interval berikutnya.
+
+        Aman dipanggil dari thread mana pun.
+        """
+        if self._loop_ref is not None:
+            self._loop_ref.call_soon_threadsafe(self._wakeup.set)
+
+    @property
+    def running(self) -> bool:
+        return self._running.locked()
+
+    def status(self) -> dict:
+        return {
+            "name": self.name,
+            "interval_seconds": self.interval,
+            "running": self.running,
+            "runs": self.runs,
+            "last_run": self.last_run,
+            "last_duration_seconds": self.last_duration,
+            "last_result": self.last_result,
+            "last_error": self.last_error,
+        }
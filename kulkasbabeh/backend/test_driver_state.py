@@ -0,0 +1,120 @@
+import os
+
+from db import STATE_COLUMNS, connect, migrate
+from driver_state import DriverStateCache
+
+
+def make_db(tmp_path):
+    conn = connect(os.path.join(tmp_path, "drivers.db"))
+    migrate(conn)
+    return conn
+
+
+def insert(conn, fingerprint_id, status="OFF", delivery_start_epoch=None):
+    row = conn.execute(f"""
+        INSERT INTO drivers (name, fingerprint_id, status, delivery_start_epoch)
+        VALUES (?, ?, ?, ?)
+        RETURNING {STATE_COLUMNS}
+    """, (f"Driver {fingerprint_id}", fingerprint_id, status, delivery_start_epoch)).fetchone()
+    conn.commit()
+    return row
+
+
+def delete(conn, cache, driver_id):
+    # Sama seperti DELETE /drivers/{id}: remove() hanya jika ada baris terhapus
+    if conn.execute("DELETE FROM drivers WHERE id = ? RETURNING id", (driver_id,)).fetchall():
+        cache.remove(driver_id)
+    conn.commit()
+
+
+def test_delete_of_missing_id_does_not_hide_later_driver(tmp_path):
+    conn = make_db(str(tmp_path))
+    cache = DriverStateCache()
+    cache.load(conn)
+    cache.apply([insert(conn, 1)])
+    delete(conn, cache, 2)
+    cache.apply([insert(conn, 2)])
+    assert [row["id"] for row in cache.select()] == [1, 2]
+    assert cache.by_fingerprint(2)["id"] == 2
+
+
+def test_check_repairs_row_with_old_tombstone(tmp_path):
+    conn = make_db(str(tmp_path))
+    cache = DriverStateCache()
+    cache.load(conn)
+    # Tombstone dari remove() lama; baris dengan id itu ada lagi di database
+    cache.remove(1)
+    insert(conn, 1)
+    report = cache.check(conn)
+    assert report["missing"] == [1]
+    assert cache.get(1)["fingerprint_id"] == 1
+    assert cache.check(conn)["consistent"]
+
+
+def test_old_row_after_remove_is_ignored(tmp_path):
+    conn = make_db(str(tmp_path))
+    insert(conn, 1)
+    cache = DriverStateCache()
+    cache.load(conn)
+    rows = conn.execute(f"SELECT {STATE_COLUMNS} FROM drivers").fetchall()
+    # Baris yang dibaca sebelum remove() tidak menghidupkan driver lagi
+    cache.remove(1)
+    cache.apply(rows)
+    assert cache.get(1) is None
+
+
+def test_stale_row_is_ignored(tmp_path):
+    conn = make_db(str(tmp_path))
+    old = insert(conn, 1)
+    new = conn.execute(f"""
+        UPDATE drivers SET status = 'STAY', row_version = row_version + 1
+        WHERE id = 1 RETURNING {STATE_COLUMNS}
+    """).fetchone()
+    conn.commit()
+    cache = DriverStateCache()
+    cache.apply([new])
+    cache.apply([old])
+    assert cache.get(1)["status"] == "STAY"
+    assert cache.check(conn)["consistent"]
+
+
+def test_fingerprint_index_follows_updates(tmp_path):
+    conn = make_db(str(tmp_path))
+    insert(conn, 7)
+    cache = DriverStateCache()
+    cache.load(conn)
+    row = conn.execute(f"""
+        UPDATE drivers SET fingerprint_id = 8, row_version = row_version + 1
+        WHERE id = 1 RETURNING {STATE_COLUMNS}
+    """).fetchone()
+    cache.apply([row])
+    assert cache.by_fingerprint(7) is None
+    assert cache.by_fingerprint(8)["id"] == 1
+
+
+def test_select_and_late_candidates(tmp_path):
+    conn = make_db(str(tmp_path))
+    insert(conn, 1, "JALAN", 100)
+    insert(conn, 2, "STAY")
+    insert(conn, 3, "JALAN", 500)
+    insert(conn, 4, "JALAN", 50)
+    cache = DriverStateCache()
+    cache.load(conn)
+    assert [row["id"] for row in cache.select(after_id=1, limit=2)] == [2, 3]
+    assert [row["id"] for row in cache.select(status="JALAN")] == [1, 3, 4]
+    assert sorted(row["id"] for row in cache.late_candidates(cutoff=100)) == [1, 4]
+    assert cache.max_id() == 4
+
+
+def test_max_fingerprint_id_follows_fingerprints_not_ids(tmp_path):
+    conn = make_db(str(tmp_path))
+    # Seperti bulk import: id driver 1, 2 memakai slot sensor 2, 3
+    insert(conn, 2)
+    insert(conn, 3)
+    cache = DriverStateCache()
+    cache.load(conn)
+    assert cache.max_id() == 2
+    assert cache.max_fingerprint_id() == 3
+    cache.remove(2)
+    assert cache.max_fingerprint_id() == 2
+    assert DriverStateCache().max_fingerprint_id() == 0
@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+from operations import OperationRegistry
+
+
+def test_resolve_wakes_waiter():
+    registry = OperationRegistry(ttl=60)
+
+    async def scenario():
+        registry.start(5)
+        waiting = asyncio.create_task(registry.wait(5, timeout=1))
+        await asyncio.sleep(0)
+        registry.resolve(5, {"id": 5, "status": "success"})
+        return await waiting
+
+    assert asyncio.run(scenario()) == {"id": 5, "status": "success"}
+    assert len(registry) == 0
+
+
+def test_wait_timeout_returns_none():
+    registry = OperationRegistry(ttl=60)
+    assert asyncio.run(registry.wait(1, timeout=0.01)) is None
+    assert registry.waiting() == 0
+
+
+def test_pop_returns_result_once():
+    registry = OperationRegistry(ttl=60)
+    registry.resolve(3, {"id": 3})
+    assert registry.pop(3) == {"id": 3}
+    assert registry.pop(3) is None
+
+
+def test_pending_until_discarded():
+    # Reservasi id tetap ada sampai driver dibuat (discard), bukan saat hasil masuk
+    registry = OperationRegistry(ttl=60)
+    registry.start(2)
+    assert registry.pending_keys() == {2}
+    registry.discard(2)
+    assert registry.pending_keys() == set()
+
+
+def test_entries_expire_and_are_bounded():
+    registry = OperationRegistry(ttl=0.01, max_entries=2)
+    for key in range(5):
+        registry.start(key)
+    assert registry.pending_keys() == {3, 4}
+    time.sleep(0.02)
+    assert registry.pending_keys() == set()
@@ -0,0 +1,85 @@
+import json
+import os
+import sqlite3
+import time
+
+from db import ConnectionPool, migrate
+from fake_broker import FakeBroker
+from outbox import AlertOutbox
+from publisher import AlertPublisher
+
+
+def make_outbox(tmp_path, **kwargs):
+    path = os.path.join(tmp_path, "drivers.db")
+    conn = sqlite3.connect(path)
+    migrate(conn)
+    conn.close()
+    broker = FakeBroker()
+    pool = ConnectionPool(path, size=2)
+    outbox = AlertOutbox(pool, AlertPublisher(broker, "alerts", retries=0), **kwargs)
+    return outbox, broker, pool
+
+
+def add(outbox, pool, payloads):
+    with pool.connection() as conn:
+        outbox.add(conn, payloads)
+        conn.commit()
+
+
+def make_due(pool):
+    with pool.connection() as conn:
+        conn.execute("UPDATE alert_outbox SET next_attempt_epoch = 0")
+        conn.commit()
+
+
+def sent(broker):
+    return [json.loads(body)["n"] for body in broker.messages("alerts")]
+
+
+def test_dispatch_sends_and_deletes(tmp_path):
+    delivered = []
+    outbox, broker, pool = make_outbox(str(tmp_path), batch_size=2, on_sent=delivered.append)
+    add(outbox, pool, [{"n": n} for n in range(3)])
+    assert outbox.dispatch() == {"sent": 3, "failed": 0, "dead": 0}
+    assert sent(broker) == [0, 1, 2]
+    assert delivered == [{"n": 0}, {"n": 1}, {"n": 2}]
+    assert outbox.stats() == {"PENDING": 0, "DEAD": 0}
+
+
+def test_failed_dispatch_backs_off(tmp_path):
+    outbox, broker, pool = make_outbox(str(tmp_path), base_backoff=60)
+    add(outbox, pool, [{"n": 1}])
+    broker.fail_next = 1
+    assert outbox.dispatch() == {"sent": 0, "failed": 1, "dead": 0}
+    with pool.connection() as conn:
+        row = conn.execute("SELECT attempts, next_attempt_epoch, last_error FROM alert_outbox").fetchone()
+    assert row["attempts"] == 1
+    assert row["next_attempt_epoch"] >= time.time() + 50
+    assert "unavailable" in row["last_error"]
+    # Belum jatuh tempo: tidak dicoba lagi walaupun broker sudah pulih
+    assert outbox.dispatch() == {"sent": 0, "failed": 0, "dead": 0}
+    make_due(pool)
+    assert outbox.dispatch()["sent"] == 1
+    assert sent(broker) == [1]
+
+
+def test_dead_after_max_attempts_until_retried(tmp_path):
+    outbox, broker, pool = make_outbox(str(tmp_path), max_attempts=2)
+    add(outbox, pool, [{"n": 1}, {"n": 2}])
+    broker.fail_next = 2
+    outbox.dispatch()
+    make_due(pool)
+    assert outbox.dispatch() == {"sent": 0, "failed": 2, "dead": 2}
+    assert outbox.stats() == {"PENDING": 0, "DEAD": 2}
+    make_due(pool)
+    assert outbox.dispatch()["sent"] == 0
+    # Seperti POST /alerts/retry
+    assert outbox.retry_dead() == 2
+    assert outbox.dispatch()["sent"] == 2
+    assert sent(broker) == [1, 2]
+
+
+def test_backoff_is_capped():
+    outbox = AlertOutbox(None, None, base_backoff=5, max_backoff=600)
+    assert [outbox.backoff(n) for n in (1, 2, 3)] == [5, 10, 20]
+    assert outbox.backoff(20) == 600
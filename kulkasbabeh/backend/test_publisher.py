@@ -0,0 +1,39 @@
+import json
+
+import pytest
+from pika.exceptions import AMQPConnectionError
+
+from fake_broker import FakeBroker
+from publisher import AlertPublisher
+
+
+def test_batch_reuses_connection_and_commits_once():
+    broker = FakeBroker()
+    publisher = AlertPublisher(broker, "alerts")
+    assert publisher.publish_batch([{"n": 1}, {"n": 2}]) == 2
+    publisher.publish({"n": 3})
+    assert broker.connections == 1
+    assert broker.commits == 2
+    assert [json.loads(body)["n"] for body in broker.messages("alerts")] == [1, 2, 3]
+
+
+def test_reconnects_after_broker_restart():
+    broker = FakeBroker()
+    publisher = AlertPublisher(broker, "alerts", retries=1)
+    publisher.publish({"n": 1})
+    broker.drop_connections()
+    # Channel lama gagal, batch diulang sekali di koneksi baru
+    publisher.publish({"n": 2})
+    assert broker.connections == 2
+    assert [json.loads(body)["n"] for body in broker.messages("alerts")] == [1, 2]
+
+
+def test_raises_when_broker_stays_down_then_recovers():
+    broker = FakeBroker()
+    publisher = AlertPublisher(broker, "alerts", retries=1)
+    broker.fail_next = 2
+    with pytest.raises(AMQPConnectionError):
+        publisher.publish({"n": 1})
+    assert broker.messages("alerts") == []
+    publisher.publish({"n": 2})
+    assert [json.loads(body)["n"] for body in broker.messages("alerts")] == [2]
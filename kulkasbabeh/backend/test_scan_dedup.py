@@ -0,0 +1,79 @@
+import time
+
+from scan_dedup import DUPLICATE, JOINED, NEW, ScanDedup
+
+RESULT = {"driver_id": 1, "new_status": "JALAN"}
+
+
+def test_repeat_within_window_is_duplicate():
+    dedup = ScanDedup(window=60)
+    state, scan = dedup.begin(1, False, 1, None)
+    assert state == NEW
+    dedup.finish(scan, RESULT, row_version=2)
+    assert dedup.begin(1, False, 2, None) == (DUPLICATE, RESULT)
+    # Scan OFF bukan duplikat dari toggle
+    assert dedup.begin(1, True, 2, None)[0] == NEW
+
+
+def test_row_version_change_invalidates_repeat():
+    dedup = ScanDedup(window=60)
+    _, scan = dedup.begin(1, False, 1, None)
+    dedup.finish(scan, RESULT, row_version=2)
+    # Driver diubah lewat jalur lain setelah scan itu
+    assert dedup.begin(1, False, 3, None)[0] == NEW
+
+
+def test_idempotency_key_returns_original_result():
+    dedup = ScanDedup(window=0, key_ttl=60)
+    _, scan = dedup.begin(1, False, 1, None, key="abc")
+    dedup.finish(scan, RESULT, row_version=2)
+    assert dedup.begin(1, False, 5, None, key="abc") == (DUPLICATE, RESULT)
+    assert dedup.begin(1, False, 5, None, key="other")[0] == NEW
+
+
+def test_inflight_scan_is_joined_within_window():
+    dedup = ScanDedup(window=60)
+    woken = []
+    _, scan = dedup.begin(1, False, 1, None)
+    assert dedup.begin(1, False, 1, woken.append) == (JOINED, None)
+    dedup.finish(scan, RESULT, row_version=2)
+    assert woken == [RESULT]
+
+
+def test_window_zero_does_not_coalesce_without_matching_key():
+    dedup = ScanDedup(window=0)
+    woken = []
+    first = dedup.begin(1, False, 1, woken.append)
+    second = dedup.begin(1, False, 1, woken.append)
+    keyed = dedup.begin(1, False, 1, woken.append, key="a")
+    assert [first[0], second[0], keyed[0]] == [NEW, NEW, NEW]
+    # Retry dengan key yang sama tetap digabung
+    assert dedup.begin(1, False, 1, woken.append, key="a") == (JOINED, None)
+    # Scan lain yang selesai lebih dulu tidak membangunkan waiter milik keyed
+    dedup.finish(second[1], RESULT, row_version=2)
+    assert woken == []
+    dedup.finish(keyed[1], RESULT, row_version=3)
+    assert woken == [RESULT]
+    dedup.finish(first[1], None)
+    assert dedup._inflight == {}
+
+
+def test_failed_scan_wakes_waiters_with_none_and_is_not_stored():
+    dedup = ScanDedup(window=60)
+    woken = []
+    _, scan = dedup.begin(1, False, 1, None)
+    dedup.begin(1, False, 1, woken.append)
+    dedup.finish(scan, None)
+    assert woken == [None]
+    assert dedup.begin(1, False, 1, None)[0] == NEW
+
+
+def test_entries_expire_and_are_bounded():
+    dedup = ScanDedup(window=0.01, max_entries=2)
+    for fingerprint_id in range(5):
+        _, scan = dedup.begin(fingerprint_id, False, 1, None)
+        dedup.finish(scan, RESULT, row_version=2)
+    assert len(dedup) == 2
+    time.sleep(0.02)
+    assert dedup.begin(4, False, 2, None)[0] == NEW
+    assert len(dedup) == 0
@@ -0,0 +1,70 @@
+import os
+import sqlite3
+import threading
+
+from db import ConnectionPool, migrate
+from scan_ingest import ScanBatcher
+
+
+def make_pool(tmp_path, n_drivers=3):
+    path = os.path.join(tmp_path, "drivers.db")
+    conn = sqlite3.connect(path)
+    migrate(conn)
+    conn.executemany(
+        "INSERT INTO drivers (name, fingerprint_id, status) VALUES (?, ?, 'OFF')",
+        [(f"Driver {i}", i) for i in range(1, n_drivers + 1)],
+    )
+    conn.commit()
+    conn.close()
+    return ConnectionPool(path, size=2)
+
+
+def status(pool, fingerprint_id):
+    with pool.connection() as conn:
+        return conn.execute("SELECT status FROM drivers WHERE fingerprint_id = ?", (fingerprint_id,)).fetchone()[0]
+
+
+def test_invalid_ts_does_not_stop_batcher(tmp_path):
+    pool = make_pool(str(tmp_path))
+    results = []
+    done = threading.Event()
+
+    def on_result(event, driver):
+        results.append((event["seq"], driver))
+        if len(results) == 3:
+            done.set()
+
+    batcher = ScanBatcher(pool, on_result, window=0.05)
+    batcher.start()
+    try:
+        # ts string di samping event tanpa ts dulu membuat sort gagal dan
+        # thread batcher mati
+        batcher.submit({"fingerprint_id": 1, "ts": "kemarin", "seq": 1})
+        batcher.submit({"fingerprint_id": 2, "seq": 2})
+        batcher.submit({"fingerprint_id": 3, "ts": "1700000000.5", "seq": 3})
+        assert done.wait(2)
+    finally:
+        batcher.stop()
+    assert sorted(seq for seq, _ in results) == [1, 2, 3]
+    assert [status(pool, fp) for fp in (1, 2, 3)] == ["STAY", "STAY", "STAY"]
+
+
+def test_events_applied_in_timestamp_order(tmp_path):
+    pool = make_pool(str(tmp_path), n_drivers=1)
+    batcher = ScanBatcher(pool, lambda event, driver: None)
+    events = [
+        {"fingerprint_id": 1, "off": True, "ts": 20.0, "received": 1.0},
+        {"fingerprint_id": 1, "ts": 10.0, "received": 2.0},
+    ]
+    applied = batcher.apply(events)
+    assert [event["ts"] for event, _ in applied] == [10.0, 20.0]
+    assert status(pool, 1) == "OFF"
+
+
+def test_apply_reports_errors_instead_of_raising(tmp_path):
+    pool = make_pool(str(tmp_path), n_drivers=1)
+    batcher = ScanBatcher(pool, lambda event, driver: None)
+    # Event dari luar submit() tanpa normalisasi ts
+    applied = batcher.apply([{"fingerprint_id": 1, "ts": "x", "received": 1.0},
+                             {"fingerprint_id": 1, "received": 2.0}])
+    assert all(isinstance(result, Exception) for _, result in applied)
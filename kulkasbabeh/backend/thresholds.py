@@ -0,0 +1,58 @@
+import sqlite3
+import threading
+
+
+class LatenessRules:
+    """Threshold keterlambatan (menit) per driver dan per zona, disalin di memori.
+
+    Urutan aturan: `late_threshold_minutes` milik driver, lalu threshold zona
+    driver, lalu default (tabel settings). Salinan dimuat dari database saat
+    start dan dimuat ulang oleh setiap endpoint yang mengubah aturan, jadi
+    cek keterlambatan dan dashboard tidak perlu query tambahan.
+    """
+
+    def __init__(self, default_minutes: int):
+        self.default_minutes = default_minutes
+        self.zones = {}
+        # driver_id -> threshold hasil resolve; hanya driver yang punya aturan
+        self._drivers = {}
+        self._lock = threading.Lock()
+
+    def reload(self, conn: sqlite3.Connection):
+        row = conn.execute("SELECT value FROM settings WHERE key = 'late_threshold_minutes'").fetchone()
+        default_minutes = int(row["value"]) if row else self.default_minutes
+        zones = {
+            zone["id"]: dict(zone)
+            for zone in conn.execute("SELECT id, name, threshold_minutes FROM zones ORDER BY id")
+        }
+        drivers = {}
+        for driver in conn.execute("""
+            SELECT id, zone_id, late_threshold_minutes FROM drivers
+            WHERE zone_id IS NOT NULL OR late_threshold_minutes IS NOT NULL
+        """):
+            minutes = driver["late_threshold_minutes"]
+            if minutes is None and driver["zone_id"] in zones:
+                minutes = zones[driver["zone_id"]]["threshold_minutes"]
+            if minutes is not None:
+                drivers[driver["id"]] = minutes
+
+        with self._lock:
+            self.default_minutes = default_minutes
+            self.zones = zones
+            self._drivers = drivers
+
+    def minutes(self, driver_id: int) -> int:
+        return self._drivers.get(driver_id, self.default_minutes)
+
+    def min_minutes(self) -> int:
+        """Threshold terkecil; driver yang mulai setelah batas ini pasti belum terlambat."""
+        with self._lock:
+            return min([self.default_minutes, *self._drivers.values()])
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "default_minutes": self.default_minutes,
+                "zones": list(self.zones.values()),
+                "drivers": dict(self._drivers)
+            }
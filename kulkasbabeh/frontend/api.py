@@ -0,0 +1,79 @@
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class ApiClient:
+    """Client backend yang dipakai bersama oleh semua sesi Streamlit.
+
+    Satu `requests.Session` dengan pool koneksi keep-alive, jadi setiap
+    rerun tidak membuka koneksi TCP baru. Hasil GET di-cache selama `ttl`
+    detik (per path + params) dan dipakai semua sesi; setelah kedaluwarsa
+    request dikirim dengan If-None-Match sehingga backend cukup membalas
+    304 jika data belum berubah. Setiap tulis lewat client ini
+    (post/put/delete) mengosongkan cache.
+    """
+
+    def __init__(self, base_url: str, ttl: float = 2.0, pool_size: int = 20, timeout: float = 10.0):
+        self.base_url = base_url
+        self.ttl = ttl
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # (path, params) -> (expires_at, etag, data)
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: str, params: dict = None, ttl: float = None, timeout: float = None):
+        """GET lalu kembalikan JSON. `ttl=0`: tanpa cache."""
+        ttl = self.ttl if ttl is None else ttl
+        key = (path, tuple(sorted((params or {}).items())))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(key) if ttl else None
+        if entry is not None and entry[0] > now:
+            return entry[2]
+
+        headers = {}
+        if entry is not None and entry[1]:
+            headers["If-None-Match"] = entry[1]
+        with self.session.get(
+            f"{self.base_url}{path}", params=params, headers=headers, timeout=timeout or self.timeout
+        ) as response:
+            if response.status_code == 304:
+                data = entry[2]
+            else:
+                response.raise_for_status()
+                data = response.json()
+            etag = response.headers.get("ETag")
+
+        if ttl:
+            with self._lock:
+                self._cache[key] = (time.monotonic() + ttl, etag, data)
+        return data
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        response = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+        if method != "GET":
+            self.invalidate()
+        return response
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path: str, **kwargs) -> requests.Response:
+        return self.request("PUT", path, **kwargs)
+
+    def delete(self, path: str, **kwargs) -> requests.Response:
+        return self.request("DELETE", path, **kwargs)
+
+    def invalidate(self):
+        # Satu tulis bisa mengubah banyak bacaan (/drivers, /dashboard, ...),
+        # jadi seluruh cache dibuang
+        with self._lock:
+            self._cache.clear()
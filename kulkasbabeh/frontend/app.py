@@ -1,12 +1,8 @@
 import streamlit as st
-import requests
-import datetime
 import time
 from streamlit_autorefresh import st_autorefresh
-import paho.mqtt.client as mqtt
-import json
-import threading
-from queue import Queue
+from live import LiveDrivers
+from api import ApiClient
 
 # --- App Setup ---
 st.set_page_config(page_title="Driver Dashboard", layout="wide")
@@ -19,69 +15,45 @@ menu = st.sidebar.radio("Navigate", ["Driver Status", "Add Driver", "Modify Driv
 
 API_URL = "http://localhost:8080"
 
-# Konfigurasi RabbitMQ
-MQTT_BROKER = "localhost"
-MQTT_PORT = 1883
-MQTT_USER = "guest"
-MQTT_PASS = "guest"
-
-ENROLL_TOPIC = "fingerprint/enroll"
-ENROLL_RESPONSE = "fingerprint/enroll/response"
-DELETE_TOPIC = "fingerprint/delete"
-DELETE_RESPONSE = "fingerprint/delete/response"
-
-enroll_queue = Queue()
-delete_queue = Queue()
-
-def on_message(client, userdata, msg):
-    if msg.topic == ENROLL_RESPONSE:
-        enroll_queue.put(msg.payload.decode())
-    elif msg.topic == DELETE_RESPONSE:
-        delete_queue.put(msg.payload.decode())
-
 @st.cache_resource
-def init_mqtt_client():
-    client = mqtt.Client()
-    client.username_pw_set(MQTT_USER, MQTT_PASS)
-    client.on_message = on_message
-    client.connect(MQTT_BROKER, MQTT_PORT, 60)
-    client.subscribe([(ENROLL_RESPONSE, 0), (DELETE_RESPONSE, 0)])
-    client.loop_start()
-    return client
+def init_api_client():
+    # Satu session HTTP (pool keep-alive + cache baca) untuk semua sesi
+    return ApiClient(API_URL)
 
-mqtt_client = init_mqtt_client()
+api = init_api_client()
 
-def publish_mqtt(topic, payload):
-    mqtt_client.publish(topic, payload)
-
-
-def wait_response_enroll_http(timeout=60):
-    start = time.time()
-    while time.time() - start < timeout:
+@st.cache_resource
+def init_live_drivers():
+    # Satu koneksi WebSocket per proses Streamlit, dipakai semua sesi
+    return LiveDrivers(API_URL).start()
+
+
+def wait_response_http(path, timeout=60):
+    # Long-poll: backend menahan request sampai ESP32 melapor (maks ~25 detik
+    # per request), lalu diulang sampai timeout habis. Hanya 200 kosong
+    # (long-poll habis) yang langsung diulang; error dan status lain diberi
+    # jeda agar backend yang bermasalah tidak dibanjiri request.
+    deadline = time.time() + timeout
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return None
         try:
-            with requests.get(f"{API_URL}/enroll/status/poll") as response:
+            with api.request("GET", path, params={"timeout": min(remaining, 25)}, timeout=remaining + 5) as response:
                 if response.status_code == 200:
                     data = response.json()
                     if data:
                         return data
+                    continue
         except Exception:
             pass
-        time.sleep(1)
-    return None
+        time.sleep(min(1, max(deadline - time.time(), 0)))
 
-def wait_response_delete_http(timeout=60):
-    start = time.time()
-    while time.time() - start < timeout:
-        try:
-            with requests.get(f"{API_URL}/delete/status/poll") as response:
-                if response.status_code == 200:
-                    data = response.json()
-                    if data:
-                        return data
-        except Exception:
-            pass
-        time.sleep(1)
-    return None
+def wait_response_enroll_http(fingerprint_id, timeout=60):
+    return wait_response_http(f"/enroll/status/wait/{fingerprint_id}", timeout)
+
+def wait_response_delete_http(fingerprint_id, timeout=60):
+    return wait_response_http(f"/delete/status/wait/{fingerprint_id}", timeout)
 
 # --- Driver Status Page ---
 if menu == "Driver Status":
@@ -89,67 +61,56 @@ if menu == "Driver Status":
     # Tampilkan judul di tengah
     st.markdown("<h1 style='text-align: center;'>DASHBOARD STATUS DRIVER</h1>", unsafe_allow_html=True)
     
+    # Threshold default disimpan di backend (berlaku untuk semua dashboard);
+    # zona / driver tertentu bisa punya threshold sendiri
+    default_minutes = api.get("/thresholds")["default_minutes"]
+
     treshold_minutes = st.number_input(
-        "Threshold keterlambatan (menit)",
+        "Threshold keterlambatan default (menit)",
         min_value=1,
-        value=45,
+        value=default_minutes,
         step=1,
-        help="Masukkan waktu maksimal pengiriman dalam menit sebelum dianggap terlambat."
+        help="Waktu maksimal pengiriman dalam menit sebelum dianggap terlambat, untuk driver tanpa threshold khusus."
     )
 
-    st_autorefresh(interval=40 * 1000, key="sync_every_minute")
-    requests.post(f"{API_URL}/sync", params={"treshold_minutes": treshold_minutes})
-    
-    # Ambil semua driver dari API
-    with requests.get(f"{API_URL}/drivers") as response:
-        drivers = response.json()
-
-    # Hitung jumlah driver untuk setiap status
-    stay_count = sum(1 for d in drivers if d["status"] == "STAY")
-    jalan_count = sum(1 for d in drivers if d["status"] == "JALAN")
-    off_count = sum(1 for d in drivers if d["status"] == "OFF")
-
-    # Kolom untuk status
-    col_STAY, col_JALAN, col_OFF = st.columns(3)
-
-    # Tambahkan judul masing-masing kolom dengan jumlah
-    with col_STAY:
-        st.subheader(f"STAY | {stay_count}")
-        st.markdown("<hr style='border: 2px solid #ccc; margin-top: 20px; margin-bottom: 20px;'>", unsafe_allow_html=True)
-    with col_JALAN:
-        st.subheader(f"JALAN | {jalan_count}")
-        st.markdown("<hr style='border: 2px solid #ccc; margin-top: 20px; margin-bottom: 20px;'>", unsafe_allow_html=True)
-    with col_OFF:
-        st.subheader(f"OFF | {off_count}")
-        st.markdown("<hr style='border: 2px solid #ccc; margin-top: 20px; margin-bottom: 20px;'>", unsafe_allow_html=True)
-
+    live_mode = st.sidebar.toggle("Live mode", value=False, help="Perbarui status lewat WebSocket tanpa memuat ulang semua data.")
 
+    if live_mode:
+        # Render hanya membaca salinan lokal; refresh cepat tidak membebani backend
+        st_autorefresh(interval=3 * 1000, key="live_refresh")
+    else:
+        st_autorefresh(interval=40 * 1000, key="sync_every_minute")
+    # Cek keterlambatan dijalankan scheduler di backend; threshold hanya
+    # dikirim saat diubah di sini
+    if treshold_minutes != default_minutes:
+        api.put("/thresholds/default", params={"minutes": treshold_minutes})
     
+    if live_mode:
+        dashboard = init_live_drivers().dashboard()
+    else:
+        # Jumlah, daftar per kolom, dan waktu jalan dihitung di backend
+        dashboard = api.get("/dashboard")
 
-    for driver in drivers:
-        id = driver["id"]
-        name = driver["name"]
-        fingerprint_id = driver["fingerprint_id"]
-        phone_number = driver.get("phone_number", "-")
-        status = driver["status"]
-        delivery_start = driver["delivery_start"]
-
-        with eval(f"col_{status}"):
-            st.subheader(f"{name}")
-            st.caption(f"Phone Number: {phone_number}")
-            if status == "JALAN" and delivery_start:
-                start_time = datetime.datetime.fromisoformat(delivery_start)
-                elapsed = (datetime.datetime.now() - start_time).total_seconds() / 60
-                progress = min(elapsed / treshold_minutes, 1.0)
-                st.progress(progress)
-                if elapsed > treshold_minutes:
-                    st.error(f"Telat! ({int(elapsed)} min)")
-                else:
-                    st.info(f"Jalan: {int(elapsed)} min")
+    # Kolom untuk status
+    columns = dict(zip(["STAY", "JALAN", "OFF"], st.columns(3)))
+
+    for status, col in columns.items():
+        with col:
+            # Judul kolom dengan jumlah
+            st.subheader(f"{status} | {dashboard['counts'][status]}")
+            st.markdown("<hr style='border: 2px solid #ccc; margin-top: 20px; margin-bottom: 20px;'>", unsafe_allow_html=True)
+
+            for driver in dashboard["drivers"][status]:
+                st.subheader(f"{driver['name']}")
+                st.caption(f"Phone Number: {driver.get('phone_number') or '-'}")
+                if "elapsed_minutes" in driver:
+                    st.progress(driver["progress"])
+                    if driver["late"]:
+                        st.error(f"Telat! ({driver['elapsed_minutes']} min)")
+                    else:
+                        st.info(f"Jalan: {driver['elapsed_minutes']} min")
 
 
-                
-                
 elif menu == "Add Driver":
     st.title("Add New Driver")
 
@@ -160,17 +121,19 @@ elif menu == "Add Driver":
 
     if submitted:
         # 1. Ambil next available ID
-        with requests.get(f"{API_URL}/drivers/next_id") as response:
-            next_id = response.json()["next_id"]
+        # Setiap panggilan mereservasi id baru sampai drivernya dibuat
+        next_id = api.post("/drivers/next_id").json()["next_id"]
 
 
-        # 2. Kirim perintah enroll ke ESP32
-        enroll_payload = json.dumps({"command": "enroll", "id": next_id})
-        publish_mqtt(ENROLL_TOPIC, enroll_payload)
+        # 2. Kirim perintah enroll ke ESP32 (lewat MQTT milik backend)
+        response = api.post(f"/enroll/{next_id}/start")
+        if response.status_code != 200:
+            st.error("Device is not reachable (MQTT broker not connected).")
+            st.stop()
 
         # 3. Tunggu fingerprint dari ESP32
         with st.spinner("Waiting for fingerprint to be enrolled..."):
-            result = wait_response_enroll_http(timeout=90)
+            result = wait_response_enroll_http(next_id, timeout=90)
 
         if result:
             try:
@@ -178,7 +141,7 @@ elif menu == "Add Driver":
                     st.success("Fingerprint enrolled successfully.")
 
                     # 4. Kirim data driver ke backend
-                    response = requests.post(f"{API_URL}/drivers", json={
+                    response = api.post("/drivers", json={
                         "name": name,
                         "phone_number": phone_number,
                         "fingerprint_id": next_id,  # fingerprint_id = id driver
@@ -203,9 +166,8 @@ elif menu == "Add Driver":
 # --- Modify Driver Page ---
 elif menu == "Modify Driver":
     st.title("Modify Driver Info and Status")
-    with requests.get(f"{API_URL}/drivers") as response:
-        drivers = response.json()
-
+    # Selectbox cukup butuh id dan nama; detail diambil untuk driver terpilih
+    drivers = api.get("/drivers", params={"fields": "id,name"})
 
     if not drivers:
         st.warning("No drivers available. Please add a driver first.")
@@ -216,7 +178,7 @@ elif menu == "Modify Driver":
 
     if selected:
         selected_id = driver_options[selected]
-        driver_data = next(d for d in drivers if d["id"] == selected_id)
+        driver_data = api.get(f"/drivers/{selected_id}")
 
         current_name = driver_data["name"]
         current_fingerprint_id = driver_data["fingerprint_id"]
@@ -234,7 +196,7 @@ elif menu == "Modify Driver":
             delete_info = st.button("Delete Driver")
 
         if update_info:
-            requests.put(f"{API_URL}/drivers/{selected_id}", json={
+            api.put(f"/drivers/{selected_id}", json={
             "id": selected_id,
             "name": new_name,
             "phone_number": new_phone_number,
@@ -242,22 +204,26 @@ elif menu == "Modify Driver":
             "status": new_status,
             "delivery_start": driver_data["delivery_start"]
         })
-            requests.put(f"{API_URL}/drivers/{selected_id}/status", params={"status": new_status})
+            api.put(f"/drivers/{selected_id}/status", params={"status": new_status})
             st.success("Driver info and status updated. Redirecting to dashboard...")
             st.session_state["redirect_to"] = "Driver Status"
             st.rerun()
         
         if delete_info:
-            payload = json.dumps({"command": "delete", "id": current_fingerprint_id})
-            publish_mqtt(DELETE_TOPIC, payload)
+            # Backend membuang hasil delete lama untuk id ini lalu mengirim
+            # perintah ke ESP32 lewat MQTT
+            response = api.post(f"/delete/{current_fingerprint_id}/start")
+            if response.status_code != 200:
+                st.error("Device is not reachable (MQTT broker not connected).")
+                st.stop()
 
             with st.spinner("Waiting for ESP32 to delete fingerprint..."):
-                result = wait_response_delete_http(timeout=90)
+                result = wait_response_delete_http(current_fingerprint_id, timeout=90)
 
             if result:
                 try:
                     if result and result.get("status") == "success":
-                        requests.delete(f"{API_URL}/drivers/{selected_id}")
+                        api.delete(f"/drivers/{selected_id}")
                         st.success("Driver deleted. Redirecting to dashboard...")
                         st.session_state["redirect_to"] = "Driver Status"
                         st.rerun()
@@ -273,8 +239,7 @@ elif menu == "Admin Page":
     st.title("Admin Management")
 
     # Fetch admin data
-    with requests.get(f"{API_URL}/admins") as response:
-        admins = response.json()
+    admins = api.get("/admins")
 
 
     st.subheader("Existing Admins")
@@ -297,7 +262,7 @@ elif menu == "Admin Page":
         submitted = st.form_submit_button("Add Admin")
 
         if submitted:
-            response = requests.post(f"{API_URL}/admins", json={
+            response = api.post("/admins", json={
                 "name": admin_name,
                 "phone_number": admin_phone
             })
@@ -318,7 +283,7 @@ elif menu == "Admin Page":
         update_button = st.button("Update Admin Info")
 
         if update_button:
-            response = requests.put(f"{API_URL}/admins/{selected_admin['id']}", json={
+            response = api.put(f"/admins/{selected_admin['id']}", json={
                 "name": new_admin_name,
                 "phone_number": new_admin_phone
             })
@@ -334,6 +299,6 @@ elif menu == "Admin Page":
         selected_admin_del = st.selectbox("Select Admin to Delete", list(admin_options.keys()), key="delete_admin_select")
         if st.button("Delete Selected Admin"):
             selected_id = admin_options[selected_admin_del]
-            requests.delete(f"{API_URL}/admins/{selected_id}")
+            api.delete(f"/admins/{selected_id}")
             st.success("Admin deleted successfully.")
             st.rerun()
@@ -0,0 +1,102 @@
+import datetime
+import json
+import threading
+import time
+
+import requests
+from websockets.sync.client import connect
+
+
+class LiveDrivers:
+    """Salinan lokal tabel drivers yang diperbarui lewat WebSocket.
+
+    Saat start, data diambil dari /drivers/changes (since=0), lalu thread
+    background mendengarkan /ws/status. Event "status" langsung diterapkan
+    ke salinan lokal; event "thresholds" memuat ulang /thresholds; event
+    lain ("changed", "resync") atau koneksi yang terputus memicu penarikan
+    delta dari /drivers/changes. Render halaman cukup membaca salinan ini
+    tanpa request ke backend.
+    """
+
+    def __init__(self, api_url: str):
+        self.api_url = api_url
+        self.ws_url = api_url.replace("http://", "ws://").replace("https://", "wss://") + "/ws/status"
+        self.drivers = {}
+        self.thresholds = {"default_minutes": 45, "drivers": {}}
+        self.version = 0
+        self.connected = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._pull_thresholds()
+        self._pull_changes()
+        self._thread.start()
+        return self
+
+    def _pull_changes(self):
+        while True:
+            with requests.get(f"{self.api_url}/drivers/changes", params={"since": self.version}, timeout=10) as response:
+                data = response.json()
+            with self._lock:
+                for change in data["changes"]:
+                    if change.get("deleted"):
+                        self.drivers.pop(change["id"], None)
+                    else:
+                        change = dict(change)
+                        change.pop("version")
+                        self.drivers[change["id"]] = change
+                self.version = data["version"]
+            if not data["has_more"]:
+                return
+
+    def _pull_thresholds(self):
+        with requests.get(f"{self.api_url}/thresholds", timeout=10) as response:
+            self.thresholds = response.json()
+
+    def _threshold(self, driver_id: int) -> int:
+        # Key JSON berupa string
+        return self.thresholds["drivers"].get(str(driver_id), self.thresholds["default_minutes"])
+
+    def _run(self):
+        while True:
+            try:
+                with connect(self.ws_url) as ws:
+                    self.connected = True
+                    # Tarik perubahan yang terlewat selama belum terhubung
+                    self._pull_thresholds()
+                    self._pull_changes()
+                    for message in ws:
+                        event = json.loads(message)
+                        if event["type"] == "status":
+                            driver = event["driver"]
+                            with self._lock:
+                                self.drivers[driver["id"]] = driver
+                        elif event["type"] == "thresholds":
+                            self._pull_thresholds()
+                        else:
+                            self._pull_changes()
+            except Exception:
+                pass
+            self.connected = False
+            time.sleep(2)
+
+    def dashboard(self) -> dict:
+        """Struktur yang sama dengan GET /dashboard, dihitung dari salinan lokal."""
+        now = datetime.datetime.now()
+        with self._lock:
+            drivers = sorted(self.drivers.values(), key=lambda d: d["id"])
+        counts = {"STAY": 0, "JALAN": 0, "OFF": 0}
+        columns = {"STAY": [], "JALAN": [], "OFF": []}
+        for d in drivers:
+            driver = {"id": d["id"], "name": d["name"], "phone_number": d["phone_number"]}
+            if d["status"] == "JALAN" and d["delivery_start"]:
+                elapsed = (now - datetime.datetime.fromisoformat(d["delivery_start"])).total_seconds() / 60
+                threshold = self._threshold(d["id"])
+                driver["elapsed_minutes"] = int(elapsed)
+                driver["threshold_minutes"] = threshold
+                driver["progress"] = min(elapsed / threshold, 1.0)
+                driver["late"] = elapsed > threshold
+            counts[d["status"]] += 1
+            columns[d["status"]].append(driver)
+        return {"treshold_minutes": self.thresholds["default_minutes"], "counts": counts, "drivers": columns}
@@ -67,6 +67,9 @@ const char *mqtt_password = "guest";
 const char *ENROLL_TOPIC = "fingerprint/enroll";
 const char *DELETE_TOPIC = "fingerprint/delete";
 const char *RESET_TOPIC = "fingerprint/resetwifi";
+// Hasil enroll/delete dikirim balik lewat koneksi MQTT yang sama
+const char *ENROLL_RESPONSE_TOPIC = "fingerprint/enroll/response";
+const char *DELETE_RESPONSE_TOPIC = "fingerprint/delete/response";
 
 WiFiClient espClient;
 PubSubClient client(espClient);
@@ -241,13 +244,9 @@ void mqttCallback(char *topic, byte *payload, unsigned int length)
     if (result != FINGERPRINT_OK)
       res["reason"] = "error";
 
-    HTTPClient http;
-    http.begin("http://31.97.106.30:8080/enroll/status");
-    http.addHeader("Content-Type", "application/json");
-    String requestBody;
-    serializeJson(res, requestBody);
-    http.POST(requestBody);
-    http.end();
+    String responseBody;
+    serializeJson(res, responseBody);
+    client.publish(ENROLL_RESPONSE_TOPIC, responseBody.c_str());
     showMessage("Ready", "", "", "", 2000);
   }
   else if (String(topic) == DELETE_TOPIC && command == "delete")
@@ -263,13 +262,9 @@ void mqttCallback(char *topic, byte *payload, unsigned int length)
     if (result != FINGERPRINT_OK)
       res["reason"] = "error";
 
-    HTTPClient http;
-    http.begin("http://31.97.106.30:8080/delete/status");
-    http.addHeader("Content-Type", "application/json");
-    String requestBody;
-    serializeJson(res, requestBody);
-    http.POST(requestBody);
-    http.end();
+    String responseBody;
+    serializeJson(res, responseBody);
+    client.publish(DELETE_RESPONSE_TOPIC, responseBody.c_str());
   }
   else if (String(topic) == RESET_TOPIC && command == "reset")
   {
@@ -425,6 +420,10 @@ void fingerprintTask(void *parameter)
           nextScanIsOff = false;
         }
 
+        // Key sama untuk semua retry scan ini: backend membalas retry dengan
+        // hasil scan pertama, jadi status tidak ter-toggle dua kali
+        String scanKey = String((uint32_t)ESP.getEfuseMac(), HEX) + "-" + String(millis());
+
         int retryHttp = 0;
         const int maxHttpRetry = 3;
         bool success = false;
@@ -436,8 +435,9 @@ void fingerprintTask(void *parameter)
           HTTPClient http;
           http.begin(url);
           http.addHeader("Content-Type", "application/json");
+          http.addHeader("Idempotency-Key", scanKey);
           int httpCode = http.POST(body);
-          if (httpCode > 0)
+          if (httpCode >= 200 && httpCode < 300)
           {
             String payload = http.getString();
             StaticJsonDocument<256> res;
@@ -454,8 +454,17 @@ void fingerprintTask(void *parameter)
             http.end();
             break;
           }
+          else if (httpCode > 0 && httpCode < 500)
+          {
+            // 4xx (mis. 404 driver tidak terdaftar): retry tidak akan berhasil
+            http.end();
+            showMessage("Scan Gagal", "HTTP " + String(httpCode));
+            break;
+          }
           else
           {
+            // Koneksi gagal atau 5xx (mis. 503 scan pertama gagal): coba
+            // ulang dengan key yang sama
             retryHttp++;
             http.end();
             delay(1000); // jeda sebelum mencoba ulang